@@ -1,69 +1,325 @@
 import streamlit as st
 import pandas as pd
-import folium
-from streamlit_folium import st_folium
-import plotly.express as px
+import streamlit.components.v1 as components
 from datetime import timedelta
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from math import radians, sin, cos, sqrt, atan2
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from math import radians, sin, cos, sqrt, asin, hypot
 import numpy as np
-from itertools import permutations
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+# orjson es opcional: decodifica JSON varias veces más rápido que la biblioteca estándar
+try:
+    import orjson
+    _cargar_json = orjson.loads
+except ImportError:
+    _cargar_json = json.loads
+
+
+# Servidor Nominatim (público por defecto; configurable para una instancia propia)
+NOMINATIM_PUBLICO = "https://nominatim.openstreetmap.org"
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", NOMINATIM_PUBLICO).rstrip("/")
+# La política de uso del servidor público no permite consultas en paralelo
+MAX_CONSULTAS_PARALELAS = 1 if NOMINATIM_URL == NOMINATIM_PUBLICO else 8
+# ni más de una consulta por segundo (con un pequeño margen)
+INTERVALO_MIN_CONSULTAS = 1.05 if NOMINATIM_URL == NOMINATIM_PUBLICO else 0.0
+_ULTIMA_CONSULTA = [0.0]
+# Reintentos ante saturación del servidor; la espera entre intentos nunca baja del intervalo mínimo
+REINTENTOS_NOMINATIM = 2
+ESPERA_BASE_REINTENTO = max(INTERVALO_MIN_CONSULTAS, 0.3)
+ESTADOS_REINTENTABLES = frozenset((429, 502, 503, 504))
+_CONSULTA_LOCK = threading.Lock()
+
+# Caché persistente de geocodificación (sobrevive a reinicios del proceso)
+GEOCACHE_PATH = os.getenv("GEOCACHE_PATH", ".geocache.sqlite")
+GEOCACHE_TTL = 86400
+# Entradas más recientes que se mantienen además en memoria (LRU)
+GEOCACHE_MEMORIA_MAX = 5000
+_GEOCACHE_LOCK = threading.Lock()
+
+
+def _normalizar_consulta(texto):
+    """Normaliza una dirección (minúsculas, sin puntuación ni espacios extra)."""
+    texto = re.sub(r"[^\w\s]", " ", texto.lower())
+    return " ".join(texto.split())
+
+
+@st.cache_resource
+def _conexion_geocache():
+    """Abre la base SQLite de la caché de geocodificación una vez por proceso."""
+    conexion = sqlite3.connect(GEOCACHE_PATH, check_same_thread=False)
+    conexion.execute(
+        "CREATE TABLE IF NOT EXISTS geocache ("
+        "clave TEXT PRIMARY KEY, valor TEXT NOT NULL, ts REAL NOT NULL)"
+    )
+    conexion.commit()
+    return conexion
+
+
+@st.cache_resource
+def _geocache_memoria():
+    """Precarga en memoria las consultas vigentes más recientes de la caché persistente."""
+    memoria = OrderedDict()
+    try:
+        with _GEOCACHE_LOCK:
+            filas = _conexion_geocache().execute(
+                "SELECT clave, valor, ts FROM geocache WHERE ts > ? ORDER BY ts DESC LIMIT ?",
+                (time.time() - GEOCACHE_TTL, GEOCACHE_MEMORIA_MAX),
+            ).fetchall()
+    except sqlite3.Error:
+        return memoria
+    for clave, valor, ts in reversed(filas):
+        memoria[clave] = (_cargar_json(valor), ts)
+    return memoria
+
+
+def _geocache_recordar(clave, valor, ts):
+    """Guarda una entrada en la caché en memoria descartando la menos usada."""
+    memoria = _geocache_memoria()
+    with _GEOCACHE_LOCK:
+        memoria[clave] = (valor, ts)
+        memoria.move_to_end(clave)
+        while len(memoria) > GEOCACHE_MEMORIA_MAX:
+            memoria.popitem(last=False)
+
+
+def _geocache_leer(clave):
+    """Devuelve el valor guardado para la clave o None si no existe o expiró."""
+    memoria = _geocache_memoria()
+    with _GEOCACHE_LOCK:
+        entrada = memoria.get(clave)
+        if entrada is not None:
+            memoria.move_to_end(clave)
+    if entrada is None:
+        try:
+            with _GEOCACHE_LOCK:
+                fila = _conexion_geocache().execute(
+                    "SELECT valor, ts FROM geocache WHERE clave = ?", (clave,)
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        if fila is None:
+            return None
+        entrada = (_cargar_json(fila[0]), fila[1])
+        _geocache_recordar(clave, *entrada)
+    if time.time() - entrada[1] > GEOCACHE_TTL:
+        return None
+    return entrada[0]
+
+
+def _geocache_guardar(clave, valor):
+    """Guarda un valor serializable en la caché persistente."""
+    _geocache_recordar(clave, valor, time.time())
+    try:
+        with _GEOCACHE_LOCK:
+            conexion = _conexion_geocache()
+            conexion.execute(
+                "INSERT OR REPLACE INTO geocache (clave, valor, ts) VALUES (?, ?, ?)",
+                (clave, json.dumps(valor), time.time()),
+            )
+            conexion.commit()
+    except sqlite3.Error:
+        pass
+
+
+@st.cache_resource
+def _sesion_nominatim():
+    """Crea una sesión HTTP compartida que reutiliza las conexiones con Nominatim."""
+    sesion = requests.Session()
+    sesion.headers.update({"User-Agent": "streamlit-app"})
+    # urllib3 solo reintenta conexiones fallidas (no llegan al servidor); los reintentos
+    # por estado HTTP los hace _consultar_nominatim pasando por el limitador de consultas
+    reintentos = Retry(total=REINTENTOS_NOMINATIM, connect=REINTENTOS_NOMINATIM, read=0, status=0, other=0)
+    adaptador = HTTPAdapter(pool_maxsize=MAX_CONSULTAS_PARALELAS, max_retries=reintentos)
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    return sesion
+
+
+def _esperar_turno_nominatim():
+    """Espera lo necesario para respetar el intervalo mínimo entre consultas."""
+    if not INTERVALO_MIN_CONSULTAS:
+        return
+    with _CONSULTA_LOCK:
+        espera = INTERVALO_MIN_CONSULTAS - (time.monotonic() - _ULTIMA_CONSULTA[0])
+        if espera > 0:
+            time.sleep(espera)
+        _ULTIMA_CONSULTA[0] = time.monotonic()
+
+
+def _consultar_nominatim(endpoint, params):
+    """Consulta un endpoint de Nominatim; cada intento respeta el intervalo entre consultas."""
+    for intento in range(REINTENTOS_NOMINATIM + 1):
+        _esperar_turno_nominatim()
+        respuesta = _sesion_nominatim().get(f"{NOMINATIM_URL}/{endpoint}", params=params, timeout=10)
+        if respuesta.status_code not in ESTADOS_REINTENTABLES or intento == REINTENTOS_NOMINATIM:
+            break
+        # Espera creciente; si el servidor indica Retry-After (en segundos) se respeta
+        espera = ESPERA_BASE_REINTENTO * 2 ** intento
+        reintentar_en = respuesta.headers.get("Retry-After", "")
+        if reintentar_en.isdigit():
+            espera = max(espera, int(reintentar_en))
+        time.sleep(espera)
+    respuesta.raise_for_status()
+    return _cargar_json(respuesta.content)
+
+
+def _buscar_en_nominatim(direccion):
+    """Consulta el endpoint de búsqueda de Nominatim sin pasar por la caché."""
+    return _consultar_nominatim("search", {"q": direccion, "format": "json", "limit": 5})
+
+
+def geocodificar_lote(direcciones):
+    """Geocodifica varias direcciones; las que no están en caché se consultan en paralelo."""
+    resultados = [[] for _ in direcciones]
+    pendientes = {}
+    for i, direccion in enumerate(direcciones):
+        if not direccion:
+            continue
+        clave = f"geo:{_normalizar_consulta(direccion)}"
+        guardado = _geocache_leer(clave)
+        if guardado is not None:
+            resultados[i] = guardado
+        else:
+            pendientes.setdefault(clave, (direccion, []))[1].append(i)
+
+    if pendientes:
+        with ThreadPoolExecutor(max_workers=min(MAX_CONSULTAS_PARALELAS, len(pendientes))) as executor:
+            futuros = {
+                clave: executor.submit(_buscar_en_nominatim, direccion)
+                for clave, (direccion, _) in pendientes.items()
+            }
+        for clave, futuro in futuros.items():
+            try:
+                encontrados = futuro.result()
+            except (requests.RequestException, ValueError):
+                continue
+            _geocache_guardar(clave, encontrados)
+            for i in pendientes[clave][1]:
+                resultados[i] = encontrados
+    return resultados
 
 
 @st.cache_data
 def geocodificar_direccion(direccion: str):
     """Devuelve posibles coincidencias para una dirección usando Nominatim."""
-    if not direccion:
-        return []
-    try:
-        respuesta = requests.get(
-            "https://nominatim.openstreetmap.org/search",
-            params={"q": direccion, "format": "json", "limit": 5},
-            headers={"User-Agent": "streamlit-app"},
-            timeout=10,
-        )
-        respuesta.raise_for_status()
-        return respuesta.json()
-    except requests.RequestException:
-        return []
+    return geocodificar_lote([direccion])[0]
 
 
 def geocodificacion_inversa(lat, lon):
     """Obtiene la dirección a partir de coordenadas."""
+    # Se consulta el punto redondeado a ~11 m: clics casi idénticos comparten entrada
+    # en la caché y la respuesta guardada corresponde exactamente a la clave
+    lat, lon = round(lat, 4), round(lon, 4)
+    clave = f"rev:{lat:.4f},{lon:.4f}"
+    guardado = _geocache_leer(clave)
+    if guardado is not None:
+        return guardado
     try:
-        respuesta = requests.get(
-            "https://nominatim.openstreetmap.org/reverse",
-            params={
-                'lat': lat,
-                'lon': lon,
-                'format': 'json',
-                'addressdetails': 1,
-                'zoom': 18
-            },
-            headers={"User-Agent": "streamlit-app"},
-            timeout=10,
-        )
-        respuesta.raise_for_status()
-        data = respuesta.json()
-        return data.get('display_name', f'Coordenadas: {lat:.4f}, {lon:.4f}')
-    except requests.RequestException:
+        data = _consultar_nominatim("reverse", {
+            'lat': lat,
+            'lon': lon,
+            'format': 'json',
+            'addressdetails': 1,
+            'zoom': 18
+        })
+    except (requests.RequestException, ValueError):
         return f'Coordenadas: {lat:.4f}, {lon:.4f}'
+    direccion = data.get('display_name', f'Coordenadas: {lat:.4f}, {lon:.4f}')
+    _geocache_guardar(clave, direccion)
+    return direccion
+
+
+RADIO_TIERRA_KM = 6371.0
+# Diferencia máxima (grados) para usar la aproximación plana en lugar de haversine
+# (con 9° el error frente a haversine no pasa de ~0.08% en las latitudes de Perú)
+LIMITE_APROX_PLANA = 9.0
+# Máximo de destinos para el algoritmo exacto (Held-Karp, tabla de 2^n x n)
+MAX_DESTINOS_EXACTO = 15
+# Nombres visibles de los algoritmos (la clave 'brute_force' se conserva por compatibilidad)
+NOMBRES_ALGORITMOS = {
+    'nearest_neighbor': 'Nearest Neighbor',
+    'brute_force': 'Exacto (Held-Karp)',
+    '2opt': '2-Opt'
+}
 
 
 def calcular_distancia(lat1, lon1, lat2, lon2):
     """Calcula la distancia en kilómetros entre dos puntos."""
-    r = 6371.0
+    # Para puntos cercanos la proyección equirectangular tiene un error < 0.1% (ver LIMITE_APROX_PLANA)
+    if abs(lat1 - lat2) < LIMITE_APROX_PLANA and abs(lon1 - lon2) < LIMITE_APROX_PLANA:
+        phi_m = radians((lat1 + lat2) * 0.5)
+        return RADIO_TIERRA_KM * hypot(radians(lat2 - lat1), radians(lon2 - lon1) * cos(phi_m))
+    return calcular_distancia_precisa(lat1, lon1, lat2, lon2)
+
+
+def calcular_distancia_precisa(lat1, lon1, lat2, lon2):
+    """Calcula la distancia en kilómetros entre dos puntos con la fórmula de haversine."""
+    r = RADIO_TIERRA_KM
     lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
     dlat = lat2 - lat1
     dlon = lon2 - lon1
     a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    # Se acota a 1 para evitar errores de dominio por redondeo en puntos antípodas
+    c = 2 * asin(min(1.0, sqrt(a)))
     return r * c
 
 
+def matriz_distancias(lats, lons):
+    """Calcula la matriz NxN de distancias (km) entre todos los puntos."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    # Todos los pares están dentro del límite si lo está el rango completo de cada eje
+    plana = np.ptp(lats) < LIMITE_APROX_PLANA and np.ptp(lons) < LIMITE_APROX_PLANA
+    lat = np.radians(lats)
+    lon = np.radians(lons)
+    # Operaciones en sitio sobre las matrices NxN para no crear temporales intermedios
+    if plana:
+        # Dos buffers NxN: el de distancias guarda primero Δlon y luego Δlat
+        distancias = np.subtract(lon[None, :], lon[:, None])
+        dlon = np.add(lat[:, None], lat[None, :])
+        dlon *= 0.5
+        np.cos(dlon, out=dlon)
+        dlon *= distancias
+        np.subtract(lat[None, :], lat[:, None], out=distancias)
+        np.hypot(distancias, dlon, out=distancias)
+    else:
+        # Puntos en coordenadas cartesianas de la esfera unitaria: la trigonometría es O(n)
+        # y cada par solo necesita la longitud de la cuerda, 2·asin(cuerda / 2)
+        cos_lat = np.cos(lat)
+        componentes = (cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat))
+        distancias = np.zeros((len(lat), len(lat)))
+        diferencia = np.empty_like(distancias)
+        for componente in componentes:
+            np.subtract(componente[None, :], componente[:, None], out=diferencia)
+            np.square(diferencia, out=diferencia)
+            distancias += diferencia
+        np.sqrt(distancias, out=distancias)
+        distancias *= 0.5
+        np.minimum(distancias, 1.0, out=distancias)
+        np.arcsin(distancias, out=distancias)
+        distancias *= 2
+    distancias *= RADIO_TIERRA_KM
+    return distancias
+
+
+# cache_data (no cache_resource): st_folium renderiza el mapa y cada render agrega
+# scripts al objeto, así que cada rerun necesita su propia copia deserializada
+@st.cache_data
 def crear_mapa_seleccion(ubicaciones_existentes=None, zoom_inicial=6):
     """Crea un mapa interactivo para seleccionar ubicaciones."""
+    # Importación diferida: folium solo se carga en las páginas que muestran mapas
+    import folium
     mapa = folium.Map(
         location=[-9.19, -75.0152], 
         zoom_start=zoom_inicial,
@@ -85,45 +341,18 @@ def crear_mapa_seleccion(ubicaciones_existentes=None, zoom_inicial=6):
     return mapa
 
 
-def optimizar_ruta_multiple(origen, destinos, algoritmo="nearest_neighbor"):
-    """
-    Optimiza el orden de visita para múltiples destinos.
-    
-    Parámetros:
-    - origen: dict con coordenadas del punto de inicio
-    - destinos: lista de dicts con coordenadas de destinos
-    - algoritmo: 'nearest_neighbor', 'brute_force', o '2opt'
-    
-    Retorna:
-    - Orden optimizado de destinos y distancia total
-    """
-    if not destinos:
-        return [], 0
-    
-    if len(destinos) == 1:
-        distancia = calcular_distancia(
-            origen['lat'], origen['lon'],
-            destinos[0]['lat'], destinos[0]['lon']
-        )
-        return [0], distancia
-    
-    # Crear matriz de distancias
-    todos_puntos = [origen] + destinos
-    n = len(todos_puntos)
-    matriz_distancia = np.zeros((n, n))
-    
-    for i in range(n):
-        for j in range(n):
-            if i != j:
-                matriz_distancia[i][j] = calcular_distancia(
-                    todos_puntos[i]['lat'], todos_puntos[i]['lon'],
-                    todos_puntos[j]['lat'], todos_puntos[j]['lon']
-                )
-    
-    if algoritmo == "nearest_neighbor":
-        return _nearest_neighbor(matriz_distancia)
-    elif algoritmo == "brute_force" and len(destinos) <= 8:
-        return _brute_force(matriz_distancia)
+def algoritmo_aplicado(algoritmo, matriz_distancia):
+    """Devuelve el algoritmo que realmente se ejecuta sobre la matriz (el exacto tiene un límite de destinos)."""
+    if algoritmo == "brute_force" and len(matriz_distancia) - 1 > MAX_DESTINOS_EXACTO:
+        return "nearest_neighbor"
+    return algoritmo if algoritmo in NOMBRES_ALGORITMOS else "nearest_neighbor"
+
+
+def _optimizar_con_matriz(matriz_distancia, algoritmo):
+    """Aplica el algoritmo elegido sobre una matriz de distancias ya calculada (origen en 0)."""
+    algoritmo = algoritmo_aplicado(algoritmo, matriz_distancia)
+    if algoritmo == "brute_force":
+        return _held_karp(matriz_distancia)
     elif algoritmo == "2opt":
         return _two_opt(matriz_distancia)
     else:
@@ -132,54 +361,63 @@ def optimizar_ruta_multiple(origen, destinos, algoritmo="nearest_neighbor"):
 
 def _nearest_neighbor(matriz_distancia):
     """Algoritmo del vecino más cercano."""
+    matriz_distancia = np.asarray(matriz_distancia)
     n = len(matriz_distancia)
-    visitados = [False] * n
+    # Penalización infinita para los visitados; se suma a la fila en un buffer reutilizado
+    penalizacion = np.zeros(n, dtype=matriz_distancia.dtype)
+    fila = np.empty(n, dtype=matriz_distancia.dtype)
     ruta = [0]  # Empezar desde el origen (índice 0)
-    visitados[0] = True
+    penalizacion[0] = np.inf
     distancia_total = 0
     
     actual = 0
     for _ in range(n - 1):
-        mejor_siguiente = -1
-        mejor_distancia = float('inf')
-        
-        for j in range(n):
-            if not visitados[j] and matriz_distancia[actual][j] < mejor_distancia:
-                mejor_distancia = matriz_distancia[actual][j]
-                mejor_siguiente = j
-        
-        if mejor_siguiente != -1:
-            ruta.append(mejor_siguiente)
-            visitados[mejor_siguiente] = True
-            distancia_total += mejor_distancia
-            actual = mejor_siguiente
+        # argmin sobre la fila con los visitados anulados, en lugar de recorrerla en Python
+        np.add(matriz_distancia[actual], penalizacion, out=fila)
+        siguiente = int(fila.argmin())
+        ruta.append(siguiente)
+        penalizacion[siguiente] = np.inf
+        distancia_total += float(fila[siguiente])
+        actual = siguiente
     
     # Convertir índices a orden de destinos (excluyendo origen)
     orden_destinos = [i - 1 for i in ruta[1:]]
     return orden_destinos, distancia_total
 
 
-def _brute_force(matriz_distancia):
-    """Fuerza bruta para rutas pequeñas (≤8 destinos)."""
-    n = len(matriz_distancia)
-    destinos_indices = list(range(1, n))  # Excluir origen (índice 0)
-    
-    mejor_distancia = float('inf')
+def _held_karp(matriz_distancia):
+    """Programación dinámica de Held-Karp: ruta óptima para pocos destinos."""
+    matriz_distancia = np.asarray(matriz_distancia)
+    m = len(matriz_distancia) - 1  # Destinos, sin contar el origen
+    # costo[mask, j]: mejor distancia desde el origen visitando `mask` y terminando en j
+    costo = np.full((1 << m, m), np.inf, dtype=matriz_distancia.dtype)
+    previo = np.full((1 << m, m), -1, dtype=np.int8)
+    bits = 1 << np.arange(m)
+    costo[bits, np.arange(m)] = matriz_distancia[0, 1:]
+    
+    mascaras = np.arange(1 << m)
+    cantidad = sum((mascaras & bit) != 0 for bit in bits)
+    entre_destinos = matriz_distancia[1:, 1:]
+    # Cada capa (mismo número de destinos visitados) solo depende de la anterior
+    for k in range(2, m + 1):
+        capa = mascaras[cantidad == k]
+        for j in range(m):
+            con_j = capa[(capa & bits[j]) != 0]
+            candidatos = costo[con_j ^ bits[j]] + entre_destinos[:, j]
+            mejor = candidatos.argmin(axis=1)
+            costo[con_j, j] = candidatos[np.arange(len(con_j)), mejor]
+            previo[con_j, j] = mejor
+    
+    completa = (1 << m) - 1
+    actual = int(costo[completa].argmin())
+    mejor_distancia = float(costo[completa, actual])
     mejor_orden = []
+    mascara = completa
+    while actual != -1:
+        mejor_orden.append(actual)
+        mascara, actual = mascara ^ (1 << actual), int(previo[mascara, actual])
     
-    for permutacion in permutations(destinos_indices):
-        distancia = 0
-        actual = 0  # Empezar desde origen
-        
-        for siguiente in permutacion:
-            distancia += matriz_distancia[actual][siguiente]
-            actual = siguiente
-        
-        if distancia < mejor_distancia:
-            mejor_distancia = distancia
-            mejor_orden = [i - 1 for i in permutacion]  # Convertir a índices de destinos
-    
-    return mejor_orden, mejor_distancia
+    return mejor_orden[::-1], mejor_distancia
 
 
 def _two_opt(matriz_distancia):
@@ -188,27 +426,35 @@ def _two_opt(matriz_distancia):
     if n <= 2:
         return [0] if n == 2 else [], 0
     
-    # Empezar con nearest neighbor
+    # Empezar con nearest neighbor (trabaja sobre el ndarray)
     ruta_inicial, _ = _nearest_neighbor(matriz_distancia)
     ruta = [0] + [i + 1 for i in ruta_inicial]  # Agregar origen al inicio
     
+    # Listas anidadas: indexar escalares en Python es mucho más barato que en un ndarray
+    matriz_distancia = np.asarray(matriz_distancia).tolist()
+    
+    distancia_total = _calcular_distancia_ruta(ruta, matriz_distancia)
+    
     mejorado = True
     while mejorado:
         mejorado = False
-        for i in range(1, len(ruta) - 2):
-            for j in range(i + 1, len(ruta)):
-                if j - i == 1:
-                    continue
-                
-                nueva_ruta = ruta[:]
-                nueva_ruta[i:j] = nueva_ruta[i:j][::-1]
+        for i in range(1, len(ruta) - 1):
+            # j == len(ruta) invierte la cola completa (movimiento válido en una ruta abierta)
+            for j in range(i + 2, len(ruta) + 1):
+                # Invertir ruta[i:j] solo cambia las aristas (a,b) y (c,d) por (a,c) y (b,d);
+                # la ruta es abierta, así que si j llega al final no existe la arista (c,d)
+                a, b, c = ruta[i - 1], ruta[i], ruta[j - 1]
+                delta = matriz_distancia[a][c] - matriz_distancia[a][b]
+                if j < len(ruta):
+                    d = ruta[j]
+                    delta += matriz_distancia[b][d] - matriz_distancia[c][d]
                 
-                if _calcular_distancia_ruta(nueva_ruta, matriz_distancia) < _calcular_distancia_ruta(ruta, matriz_distancia):
-                    ruta = nueva_ruta
+                if delta < -1e-12:
+                    ruta[i:j] = ruta[i:j][::-1]
+                    distancia_total += delta
                     mejorado = True
     
     orden_destinos = [i - 1 for i in ruta[1:]]
-    distancia_total = _calcular_distancia_ruta(ruta, matriz_distancia)
     return orden_destinos, distancia_total
 
 
@@ -220,9 +466,10 @@ def _calcular_distancia_ruta(ruta, matriz_distancia):
     return distancia
 
 
+@st.cache_data(show_spinner=False)
 def analizar_rutas_conductor(conductor_id, rutas_df, coordenadas_dict):
     """Analiza todas las rutas de un conductor y sugiere optimizaciones."""
-    rutas_conductor = rutas_df[rutas_df['conductor_id'] == conductor_id].copy()
+    rutas_conductor = rutas_de_conductor(rutas_df, conductor_id)
     
     if rutas_conductor.empty:
         return None
@@ -230,19 +477,24 @@ def analizar_rutas_conductor(conductor_id, rutas_df, coordenadas_dict):
     # Agrupar por fecha y estado para rutas del mismo día
     rutas_pendientes = rutas_conductor[
         rutas_conductor['estado'].isin(['Planificada', 'En progreso'])
-    ].copy()
+    ]
     
     if rutas_pendientes.empty:
         return {"mensaje": "No hay rutas pendientes para optimizar"}
     
-    # Agrupar por fecha
-    rutas_por_fecha = rutas_pendientes.groupby(rutas_pendientes['fecha_inicio'].dt.date)
+    # Agrupar por fecha truncando en NumPy (datetime64[D]), sin un objeto date por fila
+    rutas_por_fecha = rutas_pendientes.groupby(
+        rutas_pendientes['fecha_inicio'].values.astype('datetime64[D]')
+    )
     
     optimizaciones = {}
+    # Coordenadas como arreglos paralelos: la matriz de cada día se arma indexándolos
+    ciudades, lats_ciudades, lons_ciudades = coordenadas_a_arreglos(coordenadas_dict)
     
-    for fecha, rutas_dia in rutas_por_fecha:
+    for dia, rutas_dia in rutas_por_fecha:
         if len(rutas_dia) <= 1:
             continue
+        fecha = dia.date()
         
         # Determinar punto de origen común (primera ruta del día)
         primera_ruta = rutas_dia.iloc[0]
@@ -255,34 +507,48 @@ def analizar_rutas_conductor(conductor_id, rutas_df, coordenadas_dict):
         else:
             continue
         
-        # Preparar destinos
-        destinos = []
-        for _, ruta in rutas_dia.iterrows():
-            if ruta['destino'] in coordenadas_dict:
-                destinos.append({
-                    'lat': coordenadas_dict[ruta['destino']][0],
-                    'lon': coordenadas_dict[ruta['destino']][1],
-                    'nombre': ruta['destino'],
-                    'id_ruta': ruta['id'],
-                    'carga': ruta['carga_kg']
-                })
+        # Posición de cada punto del día en los arreglos de coordenadas (-1 si no existe)
+        idx_destinos = ciudades.get_indexer(rutas_dia['destino'])
+        con_coordenadas = idx_destinos >= 0
+        idx_puntos = np.concatenate(([ciudades.get_loc(origen['nombre'])], idx_destinos[con_coordenadas]))
+        lats_puntos = lats_ciudades[idx_puntos]
+        lons_puntos = lons_ciudades[idx_puntos]
+        
+        # Preparar destinos (metadatos para mostrar; el cálculo usa los arreglos)
+        destinos = [
+            {
+                'lat': lat,
+                'lon': lon,
+                'nombre': destino,
+                'id_ruta': id_ruta,
+                'carga': carga
+            }
+            for destino, id_ruta, carga, lat, lon in zip(
+                rutas_dia['destino'][con_coordenadas].tolist(),
+                rutas_dia['id'][con_coordenadas].tolist(),
+                rutas_dia['carga_kg'][con_coordenadas].tolist(),
+                lats_puntos[1:].tolist(),
+                lons_puntos[1:].tolist(),
+            )
+        ]
         
         if len(destinos) < 2:
             continue
         
         # Optimizar rutas
-        algoritmo = "brute_force" if len(destinos) <= 6 else "2opt"
-        orden_optimizado, distancia_optimizada = optimizar_ruta_multiple(origen, destinos, algoritmo)
+        # Solución exacta mientras Held-Karp sea barato; 2-opt para días más largos
+        algoritmo = "brute_force" if len(destinos) <= MAX_DESTINOS_EXACTO else "2opt"
+        # float32 contiguo: la mitad de bytes por fila en los recorridos de los algoritmos
+        matriz_distancia = matriz_distancias(lats_puntos, lons_puntos).astype(np.float32)
+        orden_optimizado, distancia_optimizada = _optimizar_con_matriz(matriz_distancia, algoritmo)
         
-        # Calcular distancia actual (sin optimizar)
-        distancia_actual = 0
-        punto_actual = origen
-        for destino in destinos:
-            distancia_actual += calcular_distancia(
-                punto_actual['lat'], punto_actual['lon'],
-                destino['lat'], destino['lon']
-            )
-            punto_actual = destino
+        # Ambas distancias se suman sobre la misma matriz; el orden original 0→1→…→n
+        # recorre la diagonal superior
+        distancia_actual = float(np.diagonal(matriz_distancia, 1).sum(dtype=np.float64))
+        secuencia = np.concatenate(([0], np.asarray(orden_optimizado) + 1))
+        distancia_optimizada = float(
+            matriz_distancia[secuencia[:-1], secuencia[1:]].sum(dtype=np.float64)
+        )
         
         # Preparar resultado
         destinos_ordenados = [destinos[i] for i in orden_optimizado]
@@ -298,14 +564,52 @@ def analizar_rutas_conductor(conductor_id, rutas_df, coordenadas_dict):
             'distancia_optimizada': distancia_optimizada,
             'ahorro_km': ahorro,
             'ahorro_porcentaje': porcentaje_ahorro,
-            'algoritmo_usado': algoritmo
+            'algoritmo_usado': algoritmo,
+            # Se conserva para re-optimizar el día con otro algoritmo sin recalcularla
+            'matriz_distancia': matriz_distancia
         }
     
     return optimizaciones
 
 
+# Leyendas fijas de los mapas (se arman una sola vez al cargar el módulo)
+LEYENDA_MAPA_OPTIMIZADO = '''
+    <div style="position: fixed; 
+                top: 10px; right: 10px; width: 200px; height: 120px; 
+                background-color: white; border:2px solid grey; z-index:9999; 
+                font-size:12px; padding: 10px">
+    <b>Optimización de Ruta</b><br>
+    <i class="fa fa-home" style="color:black"></i> Origen<br>
+    <i class="fa fa-circle" style="color:green"></i> Ruta Optimizada<br>
+    <i class="fa fa-circle" style="color:red"></i> Ruta Original<br>
+    <i class="fa fa-map-marker" style="color:green"></i> Destinos (orden)
+    </div>
+    '''
+
+LEYENDA_MAPA_RUTAS = '''
+    <div style="position: fixed; 
+                top: 10px; right: 10px; width: 150px; height: 90px; 
+                background-color: white; border:2px solid grey; z-index:9999; 
+                font-size:14px; padding: 10px">
+    <b>Estado de Rutas</b><br>
+    <i class="fa fa-circle" style="color:green"></i> Completada<br>
+    <i class="fa fa-circle" style="color:red"></i> En progreso<br>
+    <i class="fa fa-circle" style="color:blue"></i> Planificada<br>
+    </div>
+    '''
+
+# Colores de las rutas según su estado
+COLORES_ESTADO_RUTA = {
+    'Completada': 'green',
+    'En progreso': 'red',
+    'Planificada': 'blue'
+}
+
+
 def crear_mapa_ruta_optimizada(optimizacion_data):
     """Crea un mapa mostrando la ruta optimizada vs la original."""
+    # Importación diferida: folium solo se carga en las páginas que muestran mapas
+    import folium
     if not optimizacion_data:
         return None
     
@@ -313,10 +617,13 @@ def crear_mapa_ruta_optimizada(optimizacion_data):
     destinos_original = optimizacion_data['destinos_original']
     destinos_optimizado = optimizacion_data['destinos_optimizado']
     
+    # Puntos de ambas líneas armados de una vez; la original también da el centro del mapa
+    puntos_originales = [[origen['lat'], origen['lon']]] + [[d['lat'], d['lon']] for d in destinos_original]
+    puntos_optimizados = [[origen['lat'], origen['lon']]] + [[d['lat'], d['lon']] for d in destinos_optimizado]
+    
     # Calcular centro del mapa
-    todas_coords = [origen] + destinos_original
-    lat_centro = sum(punto['lat'] for punto in todas_coords) / len(todas_coords)
-    lon_centro = sum(punto['lon'] for punto in todas_coords) / len(todas_coords)
+    lat_centro = sum(punto[0] for punto in puntos_originales) / len(puntos_originales)
+    lon_centro = sum(punto[1] for punto in puntos_originales) / len(puntos_originales)
     
     mapa = folium.Map(location=[lat_centro, lon_centro], zoom_start=10)
     
@@ -337,10 +644,6 @@ def crear_mapa_ruta_optimizada(optimizacion_data):
         ).add_to(mapa)
     
     # Ruta optimizada (línea verde)
-    puntos_optimizados = [[origen['lat'], origen['lon']]]
-    for destino in destinos_optimizado:
-        puntos_optimizados.append([destino['lat'], destino['lon']])
-    
     folium.PolyLine(
         puntos_optimizados,
         color='green',
@@ -350,10 +653,6 @@ def crear_mapa_ruta_optimizada(optimizacion_data):
     ).add_to(mapa)
     
     # Ruta original (línea roja punteada)
-    puntos_originales = [[origen['lat'], origen['lon']]]
-    for destino in destinos_original:
-        puntos_originales.append([destino['lat'], destino['lon']])
-    
     folium.PolyLine(
         puntos_originales,
         color='red',
@@ -364,31 +663,147 @@ def crear_mapa_ruta_optimizada(optimizacion_data):
     ).add_to(mapa)
     
     # Leyenda
-    leyenda_html = '''
-    <div style="position: fixed; 
-                top: 10px; right: 10px; width: 200px; height: 120px; 
-                background-color: white; border:2px solid grey; z-index:9999; 
-                font-size:12px; padding: 10px">
-    <b>Optimización de Ruta</b><br>
-    <i class="fa fa-home" style="color:black"></i> Origen<br>
-    <i class="fa fa-circle" style="color:green"></i> Ruta Optimizada<br>
-    <i class="fa fa-circle" style="color:red"></i> Ruta Original<br>
-    <i class="fa fa-map-marker" style="color:green"></i> Destinos (orden)
-    </div>
-    '''
-    mapa.get_root().html.add_child(folium.Element(leyenda_html))
+    mapa.get_root().html.add_child(folium.Element(LEYENDA_MAPA_OPTIMIZADO))
     
     return mapa
 
 
+@st.cache_data(max_entries=16)
+def construir_mapa_optimizado_html(optimizacion_data):
+    """Devuelve el HTML renderizado del mapa de una ruta optimizada, o None si no hay datos."""
+    mapa = crear_mapa_ruta_optimizada(optimizacion_data)
+    return mapa.get_root().render() if mapa else None
+
+
+@st.cache_data(max_entries=8)
+def construir_mapa_rutas_html(rutas, coordenadas):
+    """Construye el mapa de rutas y devuelve su HTML renderizado."""
+    # Importación diferida: folium y sus plugins solo se cargan si se visita el mapa de rutas
+    import folium
+    from folium.plugins import MarkerCluster
+
+    # Crear mapa centrado en Perú
+    mapa = folium.Map(location=[-9.19, -75.0152], zoom_start=6)
+
+    # Posiciones de origen y destino en los arreglos de coordenadas (-1 si la ciudad no existe)
+    ciudades, lats, lons = coordenadas_a_arreglos(coordenadas)
+    idx_origen = ciudades.get_indexer(rutas['origen'])
+    idx_destino = ciudades.get_indexer(rutas['destino'])
+    con_coordenadas = (idx_origen >= 0) & (idx_destino >= 0)
+    idx_origen = idx_origen[con_coordenadas]
+    idx_destino = idx_destino[con_coordenadas]
+
+    # Marcadores agrupados en clúster; las líneas se juntan en una sola capa GeoJSON
+    cluster = MarkerCluster().add_to(mapa)
+    lineas = []
+    # Un marcador por (tipo, ciudad, estado) que lista los IDs de todas sus rutas
+    marcadores = {}
+
+    # Color de cada ruta indexando una paleta por el código categórico del estado
+    # (el código -1 de un estado vacío cae en el último color, gris)
+    estados = rutas['estado'].astype(ESTADO_RUTA_DTYPE)
+    paleta = np.array([COLORES_ESTADO_RUTA.get(e, 'gray') for e in estados.cat.categories] + ['gray'])
+    colores = paleta[estados.cat.codes.values[con_coordenadas]]
+
+    # Textos de las líneas armados por columnas en lugar de un f-string por ruta
+    en_mapa = rutas[con_coordenadas]
+    popups_rutas = (
+        'Ruta ' + en_mapa['id'].astype(str) + ': ' + en_mapa['origen'].astype(str)
+        + ' → ' + en_mapa['destino'].astype(str)
+        + '<br>Estado: ' + en_mapa['estado'].astype(str)
+        + '<br>Distancia: ' + en_mapa['distancia_km'].astype(str) + ' km'
+    )
+
+    # Agregar marcadores y líneas para cada ruta
+    if con_coordenadas.any():
+        for ruta_id, color, origen, destino, popup_ruta, lat_o, lon_o, lat_d, lon_d in zip(
+            en_mapa['id'].values,
+            colores.tolist(),
+            en_mapa['origen'].values,
+            en_mapa['destino'].values,
+            popups_rutas.tolist(),
+            lats[idx_origen],
+            lons[idx_origen],
+            lats[idx_destino],
+            lons[idx_destino],
+        ):
+            # Coordenadas de origen y destino
+            coord_origen = [lat_o, lon_o]
+            coord_destino = [lat_d, lon_d]
+
+            marcadores.setdefault(('Origen', origen, color), (coord_origen, []))[1].append(ruta_id)
+            marcadores.setdefault(('Destino', destino, color), (coord_destino, []))[1].append(ruta_id)
+
+            # Línea de la ruta (GeoJSON usa el orden lon, lat)
+            lineas.append({
+                'type': 'Feature',
+                'geometry': {'type': 'LineString', 'coordinates': [[lon_o, lat_o], [lon_d, lat_d]]},
+                'properties': {'color': color, 'popup': popup_ruta}
+            })
+
+    # Todas las líneas en un único objeto, en lugar de una PolyLine con su popup por ruta
+    if lineas:
+        folium.GeoJson(
+            {'type': 'FeatureCollection', 'features': lineas},
+            name='rutas',
+            style_function=lambda linea: {'color': linea['properties']['color'], 'weight': 3, 'opacity': 0.7},
+            popup=folium.GeoJsonPopup(fields=['popup'], labels=False, localize=False)
+        ).add_to(mapa)
+
+    for (tipo, ciudad, color), (coord, ids) in marcadores.items():
+        folium.Marker(
+            coord,
+            popup=f"{tipo}: {ciudad}<br>Ruta ID: {', '.join(map(str, ids))}",
+            icon=folium.Icon(color=color, icon='play' if tipo == 'Origen' else 'stop')
+        ).add_to(cluster)
+
+    # Agregar leyenda
+    mapa.get_root().html.add_child(folium.Element(LEYENDA_MAPA_RUTAS))
+
+    return mapa.get_root().render()
+
+
+@st.cache_data(show_spinner=False)
+def vista_previa_ruta(lat1, lon1, lat2, lon2, popup_origen, popup_destino):
+    """Calcula la distancia y el HTML del mapa de vista previa para un par origen-destino."""
+    # Importación diferida: folium solo se carga en las páginas que muestran mapas
+    import folium
+    distancia = calcular_distancia(lat1, lon1, lat2, lon2)
+    mapa_prev = folium.Map(location=[(lat1 + lat2) / 2, (lon1 + lon2) / 2], zoom_start=8)
+    
+    folium.Marker(
+        [lat1, lon1], 
+        popup=popup_origen,
+        icon=folium.Icon(color='green', icon='play')
+    ).add_to(mapa_prev)
+    
+    folium.Marker(
+        [lat2, lon2], 
+        popup=popup_destino,
+        icon=folium.Icon(color='red', icon='stop')
+    ).add_to(mapa_prev)
+    
+    folium.PolyLine(
+        [[lat1, lon1], [lat2, lon2]], 
+        color="blue", 
+        weight=4, 
+        opacity=0.8,
+        popup=f"Distancia: {distancia:.1f} km"
+    ).add_to(mapa_prev)
+    
+    return distancia, mapa_prev.get_root().render()
+
+
 def generar_plan_ruta_conductor(conductor_id, conductores_df, rutas_df, coordenadas_dict):
     """Genera un plan completo de rutas optimizadas para un conductor."""
-    conductor_info = conductores_df[conductores_df['id'] == conductor_id].iloc[0]
     optimizaciones = analizar_rutas_conductor(conductor_id, rutas_df, coordenadas_dict)
     
     if not optimizaciones or 'mensaje' in optimizaciones:
         return None
     
+    # Solo se busca la ficha del conductor si hay un plan que mostrar
+    conductor_info = conductores_df[conductores_df['id'] == conductor_id].iloc[0]
+    
     plan = {
         'conductor': conductor_info,
         'fechas_optimizadas': {},
@@ -430,20 +845,71 @@ st.set_page_config(
     layout="wide"
 )
 
+# Columnas de baja cardinalidad se guardan como categóricas
+ESTADOS_CONDUCTOR = ['Activo', 'En ruta', 'Descanso', 'Mantenimiento']
+ESTADOS_RUTA = ['Planificada', 'En progreso', 'Completada']
+ESTADO_CONDUCTOR_DTYPE = pd.CategoricalDtype(ESTADOS_CONDUCTOR)
+ESTADO_RUTA_DTYPE = pd.CategoricalDtype(ESTADOS_RUTA)
+# Columnas de texto libre se guardan en memoria contigua de Arrow
+TEXTO_DTYPE = pd.StringDtype('pyarrow')
+COLUMNAS_TEXTO_CONDUCTOR = ['nombre', 'licencia', 'telefono', 'vehiculo']
+
+
+def tipar_conductores(df):
+    """Convierte las columnas categóricas y de texto de conductores a su dtype."""
+    tipos = dict.fromkeys(COLUMNAS_TEXTO_CONDUCTOR, TEXTO_DTYPE)
+    tipos['estado'] = ESTADO_CONDUCTOR_DTYPE
+    return df.astype(tipos)
+
+
+def tipar_rutas(df):
+    """Convierte las columnas categóricas, enteras y de fecha de rutas a su dtype."""
+    return df.astype({
+        'id': 'int32',
+        'conductor_id': 'int32',
+        'carga_kg': 'int32',
+        'estado': ESTADO_RUTA_DTYPE,
+        'origen': 'category',
+        'destino': 'category',
+        'fecha_inicio': 'datetime64[ns]',
+        'fecha_fin': 'datetime64[ns]'
+    })
+
+
+def agregar_fila(tabla, fila):
+    """Encola una fila nueva para la tabla ('conductores' o 'rutas') de la sesión."""
+    st.session_state[f'{tabla}_pendientes'].append(fila)
+
+
+def materializar_pendientes(tabla, tipar):
+    """Incorpora las filas encoladas al DataFrame de la sesión con un solo concat."""
+    pendientes = st.session_state[f'{tabla}_pendientes']
+    if pendientes:
+        st.session_state[f'{tabla}_df'] = tipar(pd.concat([
+            st.session_state[f'{tabla}_df'],
+            pd.DataFrame(pendientes)
+        ], ignore_index=True))
+        st.session_state[f'{tabla}_pendientes'] = []
+    return st.session_state[f'{tabla}_df']
+
+
 # Función para inicializar datos de ejemplo (solo rutas y coordenadas)
-@st.cache_data
+# cache_resource: los datos base se comparten entre sesiones sin copiarlos ni hashearlos;
+# las sesiones nunca los modifican en sitio (agregar filas crea un DataFrame nuevo)
+@st.cache_resource
 def load_sample_data():
     # Solo datos de rutas de ejemplo (se eliminarán cuando se carguen conductores)
+    # Las columnas se crean ya con su dtype final, sin inferencia ni conversión posterior
     rutas = pd.DataFrame({
-        'id': [],
-        'conductor_id': [],
-        'origen': [],
-        'destino': [],
-        'distancia_km': [],
-        'fecha_inicio': [],
-        'fecha_fin': [],
-        'estado': [],
-        'carga_kg': []
+        'id': pd.Series(dtype='int32'),
+        'conductor_id': pd.Series(dtype='int32'),
+        'origen': pd.Series(dtype='category'),
+        'destino': pd.Series(dtype='category'),
+        'distancia_km': pd.Series(dtype='float64'),
+        'fecha_inicio': pd.Series(dtype='datetime64[ns]'),
+        'fecha_fin': pd.Series(dtype='datetime64[ns]'),
+        'estado': pd.Series(dtype=ESTADO_RUTA_DTYPE),
+        'carga_kg': pd.Series(dtype='int32')
     })
     
     # Coordenadas de ciudades principales del Perú
@@ -470,6 +936,165 @@ def load_sample_data():
     return rutas, coordenadas
 
 
+@st.cache_data
+def construir_indice_nombres(conductores):
+    """Devuelve un diccionario nombre -> id (primer conductor con ese nombre)."""
+    indice = {}
+    for nombre, conductor_id in zip(conductores['nombre'].tolist(), conductores['id'].tolist()):
+        indice.setdefault(nombre, conductor_id)
+    return indice
+
+
+@st.cache_data
+def nombres_por_id(conductores):
+    """Devuelve una Serie id -> nombre para asignar nombres sin hacer merge."""
+    return conductores.set_index('id')['nombre']
+
+
+def coordenadas_a_arreglos(coordenadas):
+    """Convierte el diccionario de coordenadas en un índice de ciudades y arreglos paralelos de lat/lon."""
+    ciudades = pd.Index(list(coordenadas))
+    valores = np.array(list(coordenadas.values()), dtype=np.float64).reshape(-1, 2)
+    return ciudades, valores[:, 0], valores[:, 1]
+
+
+@st.cache_data
+def indices_por_estado(df):
+    """Devuelve las posiciones de las filas de cada estado presente (en orden de aparición)."""
+    return df.groupby('estado', observed=True, sort=False).indices
+
+
+@st.cache_data
+def indices_por_conductor(rutas):
+    """Devuelve las posiciones de las rutas de cada conductor, en el orden original."""
+    return rutas.groupby('conductor_id', sort=False).indices
+
+
+def rutas_de_conductor(rutas, conductor_id):
+    """Selecciona las rutas de un conductor sin recorrer toda la columna conductor_id."""
+    return rutas.iloc[indices_por_conductor(rutas).get(conductor_id, np.array([], dtype=np.intp))]
+
+
+@st.cache_data
+def estadisticas_por_conductor(rutas, conductores):
+    """Agrega número de rutas, distancia y carga por conductor en un solo groupby."""
+    # sort=False: los conductores quedan en el orden en que aparecen sus rutas
+    estadisticas = rutas.groupby('conductor_id', sort=False).agg(
+        num_rutas=('id', 'size'),
+        distancia_total=('distancia_km', 'sum'),
+        distancia_promedio=('distancia_km', 'mean'),
+        carga_total=('carga_kg', 'sum'),
+        carga_promedio=('carga_kg', 'mean'),
+    ).reset_index()
+    # Solo conductores existentes, como lo haría un inner join
+    estadisticas['id'] = estadisticas['conductor_id']
+    estadisticas['nombre'] = estadisticas['conductor_id'].map(nombres_por_id(conductores))
+    return estadisticas[estadisticas['nombre'].notna()].reset_index(drop=True)
+
+
+@st.cache_data
+def rutas_por_dia(rutas):
+    """Cuenta las rutas programadas por día de inicio."""
+    # Conteo directamente sobre datetime64[D], sin crear un objeto date por fila
+    dias = rutas['fecha_inicio'].values.astype('datetime64[D]')
+    dias, conteos = np.unique(dias[~np.isnat(dias)], return_counts=True)
+    return tuple(dias.tolist()), tuple(conteos.tolist())
+
+
+@st.cache_data
+def metricas_dashboard(rutas, conductores):
+    """Calcula las métricas y conteos por estado del dashboard en una sola llamada."""
+    estado_conductores = conductores['estado'].value_counts()
+    estado_conductores = estado_conductores[estado_conductores > 0]
+    estado_rutas = rutas['estado'].value_counts()
+    # Las rutas activas salen del mismo conteo por estado, sin otra pasada con máscara
+    rutas_activas = int(estado_rutas.get('En progreso', 0))
+    estado_rutas = estado_rutas[estado_rutas > 0]
+    return {
+        'total_conductores': len(conductores),
+        'rutas_activas': rutas_activas,
+        'distancia_total': float(rutas['distancia_km'].sum()),
+        'carga_total': int(rutas['carga_kg'].sum()),
+        # (valores, nombres) listos para los gráficos de pastel
+        'estado_conductores': (tuple(estado_conductores.tolist()), tuple(estado_conductores.index)),
+        'estado_rutas': (tuple(estado_rutas.tolist()), tuple(estado_rutas.index))
+    }
+
+
+# Gráficos de resumen sin interacción: plotly.js no carga la barra de herramientas ni los eventos
+CONFIG_GRAFICO_ESTATICO = {'displayModeBar': False, 'staticPlot': True}
+
+
+# Figuras de Plotly cacheadas como JSON: solo se reconstruyen si cambian sus datos
+@st.cache_data(max_entries=16)
+def figura_pastel(valores, nombres, titulo):
+    """Devuelve el JSON de un gráfico de pastel."""
+    fig = go.Figure(go.Pie(values=valores, labels=nombres))
+    fig.update_layout(title=titulo, uirevision='keep')
+    return fig.to_json()
+
+
+@st.cache_data(max_entries=16)
+def figura_barras(x, y, titulo, titulo_x, titulo_y):
+    """Devuelve el JSON de un gráfico de barras con etiquetas inclinadas."""
+    fig = go.Figure(go.Bar(x=x, y=y))
+    fig.update_layout(title=titulo, xaxis_title=titulo_x, yaxis_title=titulo_y, uirevision='keep')
+    fig.update_xaxes(tickangle=45)
+    return fig.to_json()
+
+
+@st.cache_data(max_entries=16)
+def figura_totales_conductor(nombres, distancias, cargas):
+    """Devuelve el JSON de las barras de distancia y carga por conductor en una sola figura."""
+    fig = make_subplots(
+        rows=1, cols=2,
+        subplot_titles=("Distancia Total por Conductor (km)", "Carga Total por Conductor (kg)")
+    )
+    fig.add_trace(go.Bar(x=nombres, y=distancias, name='Distancia (km)'), row=1, col=1)
+    fig.add_trace(go.Bar(x=nombres, y=cargas, name='Carga (kg)'), row=1, col=2)
+    fig.update_xaxes(title_text='Conductor', tickangle=45)
+    fig.update_yaxes(title_text='Distancia (km)', row=1, col=1)
+    fig.update_yaxes(title_text='Carga (kg)', row=1, col=2)
+    fig.update_layout(showlegend=False, uirevision='keep')
+    return fig.to_json()
+
+
+@st.cache_data(max_entries=16)
+def figura_linea(x, y, titulo, titulo_x, titulo_y):
+    """Devuelve el JSON de un gráfico de líneas."""
+    fig = go.Figure(go.Scatter(x=x, y=y, mode='lines'))
+    fig.update_layout(title=titulo, xaxis_title=titulo_x, yaxis_title=titulo_y, uirevision='keep')
+    return fig.to_json()
+
+
+@st.cache_data(max_entries=16)
+def figura_comparacion(fechas, distancias_actual, distancias_optimizada):
+    """Devuelve el JSON del gráfico de barras agrupadas de distancia actual vs optimizada."""
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        name='Ruta Actual',
+        x=fechas,
+        y=distancias_actual,
+        marker_color='red',
+        opacity=0.7
+    ))
+    fig.add_trace(go.Bar(
+        name='Ruta Optimizada',
+        x=fechas,
+        y=distancias_optimizada,
+        marker_color='green',
+        opacity=0.7
+    ))
+    fig.update_layout(
+        title='Comparación de Distancias: Actual vs Optimizada',
+        xaxis_title='Fecha',
+        yaxis_title='Distancia (km)',
+        barmode='group',
+        uirevision='keep'
+    )
+    return fig.to_json()
+
+
 def cargar_archivo_conductores(archivo_cargado):
     """
     Carga archivo Excel o CSV con datos de conductores.
@@ -503,7 +1128,7 @@ def cargar_archivo_conductores(archivo_cargado):
             return None, "❌ Error: IDs de conductores duplicados encontrados"
         
         # Validar estados válidos
-        estados_validos = ['Activo', 'En ruta', 'Descanso', 'Mantenimiento']
+        estados_validos = ESTADOS_CONDUCTOR
         estados_invalidos = df[~df['estado'].isin(estados_validos)]['estado'].unique()
         
         if len(estados_invalidos) > 0:
@@ -515,6 +1140,7 @@ def cargar_archivo_conductores(archivo_cargado):
         df['telefono'] = df['telefono'].astype(str).str.strip()
         df['vehiculo'] = df['vehiculo'].astype(str).str.strip()
         df['id'] = df['id'].astype(int)
+        df = tipar_conductores(df)
         
         return df, f"✅ Archivo cargado exitosamente: {len(df)} conductores"
         
@@ -535,13 +1161,16 @@ def generar_plantilla_conductores():
     return plantilla
 
 # Cargar datos y almacenar en session_state
-rutas_default, coordenadas_dict = load_sample_data()
+rutas_default, coordenadas_default = load_sample_data()
 
 # Inicializar DataFrames en session_state
 if 'conductores_df' not in st.session_state:
-    st.session_state['conductores_df'] = pd.DataFrame(columns=['id', 'nombre', 'licencia', 'telefono', 'vehiculo', 'estado'])
+    st.session_state['conductores_df'] = tipar_conductores(pd.DataFrame(columns=['id', 'nombre', 'licencia', 'telefono', 'vehiculo', 'estado']))
 if 'rutas_df' not in st.session_state:
-    st.session_state['rutas_df'] = rutas_default.copy()
+    st.session_state['rutas_df'] = rutas_default
+if 'coordenadas_dict' not in st.session_state:
+    # Copia propia por sesión: las rutas nuevas agregan ciudades al diccionario
+    st.session_state['coordenadas_dict'] = dict(coordenadas_default)
 if 'conductores_cargados' not in st.session_state:
     st.session_state['conductores_cargados'] = False
 if 'direccion_origen_seleccionada' not in st.session_state:
@@ -556,9 +1185,22 @@ if 'distancia_calculada' not in st.session_state:
     st.session_state['distancia_calculada'] = None
 if 'ubicacion_temporal' not in st.session_state:
     st.session_state['ubicacion_temporal'] = None
+if 'conductores_pendientes' not in st.session_state:
+    st.session_state['conductores_pendientes'] = []
+if 'rutas_pendientes' not in st.session_state:
+    st.session_state['rutas_pendientes'] = []
+# Fechas cuyo mapa optimizado está desplegado en la página de optimización
+if 'mapas_visibles' not in st.session_state:
+    st.session_state['mapas_visibles'] = set()
+
+# Las altas individuales se acumulan en listas y se materializan aquí una vez por rerun
+conductores_df = materializar_pendientes('conductores', tipar_conductores)
+rutas_df = materializar_pendientes('rutas', tipar_rutas)
+coordenadas_dict = st.session_state['coordenadas_dict']
 
-conductores_df = st.session_state['conductores_df']
-rutas_df = st.session_state['rutas_df']
+# Índice nombre -> id para evitar filtrar el DataFrame en cada búsqueda
+nombre_a_id = construir_indice_nombres(conductores_df)
+nombres_conductores = list(nombre_a_id)
 
 # Verificar si hay conductores cargados
 if not st.session_state['conductores_cargados'] or conductores_df.empty:
@@ -585,6 +1227,11 @@ def procesar_click_mapa(data_mapa, tipo_ubicacion):
         lat = data_mapa['last_clicked']['lat']
         lon = data_mapa['last_clicked']['lng']
         
+        # Los reruns repiten el último clic: se reutiliza la ubicación ya resuelta
+        anterior = st.session_state.get('ubicacion_temporal')
+        if anterior and (anterior['lat'], anterior['lon'], anterior['tipo']) == (lat, lon, tipo_ubicacion):
+            return anterior
+        
         # Obtener dirección aproximada
         direccion = geocodificacion_inversa(lat, lon)
         
@@ -598,6 +1245,125 @@ def procesar_click_mapa(data_mapa, tipo_ubicacion):
     
     return None
 
+def seleccionar_resultado_busqueda(tipo_ubicacion):
+    """Guarda el resultado de búsqueda elegido en el radio como origen o destino."""
+    indice = st.session_state[f'radio_{tipo_ubicacion}_texto']
+    resultado = st.session_state[f'resultados_{tipo_ubicacion}'][indice]
+    resultado['metodo_seleccion'] = 'busqueda'
+    st.session_state[f'direccion_{tipo_ubicacion}_seleccionada'] = resultado
+    st.session_state[f'resultados_{tipo_ubicacion}'] = []
+
+
+def quitar_seleccion(tipo_ubicacion):
+    """Descarta el origen o destino seleccionado antes de que se vuelva a ejecutar la página."""
+    st.session_state[f'direccion_{tipo_ubicacion}_seleccionada'] = None
+
+
+# Fragmento: los clics en el mapa solo vuelven a ejecutar este bloque, no toda la página
+@st.fragment
+def fragmento_seleccion_mapa():
+    """Muestra el mapa de selección de origen/destino y procesa sus clics."""
+    # Importación diferida: streamlit_folium solo se carga en la página de rutas
+    from streamlit_folium import st_folium
+    
+    # Selector de qué ubicación se está marcando
+    col1, col2 = st.columns(2)
+    with col1:
+        seleccionando = st.radio(
+            "¿Qué ubicación estás seleccionando?",
+            ["📍 Origen", "🎯 Destino"],
+            key="radio_seleccion_mapa"
+        )
+    
+    with col2:
+        if st.button("🔄 Limpiar Selecciones", key="limpiar_mapa"):
+            st.session_state['direccion_origen_seleccionada'] = None
+            st.session_state['direccion_destino_seleccionada'] = None
+            st.session_state['ubicacion_temporal'] = None
+            st.rerun()
+    
+    # Preparar ubicaciones existentes para mostrar en el mapa
+    ubicaciones_para_mapa = {}
+    if st.session_state['direccion_origen_seleccionada']:
+        origen = st.session_state['direccion_origen_seleccionada']
+        ubicaciones_para_mapa['Origen'] = {
+            'lat': float(origen['lat']),
+            'lon': float(origen['lon']),
+            'tipo': 'origen'
+        }
+
+    if st.session_state['direccion_destino_seleccionada']:
+        destino = st.session_state['direccion_destino_seleccionada']
+        ubicaciones_para_mapa['Destino'] = {
+            'lat': float(destino['lat']),
+            'lon': float(destino['lon']),
+            'tipo': 'destino'
+        }
+
+    # Crear y mostrar el mapa interactivo
+    mapa_seleccion = crear_mapa_seleccion(ubicaciones_para_mapa)
+
+    # Mostrar el mapa y capturar interacciones
+    map_data = st_folium(
+        mapa_seleccion, 
+        width=700, 
+        height=400,
+        key="mapa_seleccion_ubicaciones",
+        # Solo se usa el último clic: no se devuelven límites, zoom ni objetos dibujados
+        returned_objects=["last_clicked"]
+    )
+
+    # Procesar clicks en el mapa
+    if map_data['last_clicked'] is not None:
+        tipo_seleccionando = "origen" if "Origen" in seleccionando else "destino"
+        
+        ubicacion_seleccionada = procesar_click_mapa(map_data, tipo_seleccionando)
+        
+        if ubicacion_seleccionada:
+            st.session_state['ubicacion_temporal'] = ubicacion_seleccionada
+            
+            st.info(f"📍 **Ubicación seleccionada para {tipo_seleccionando}:**")
+            st.write(f"**Coordenadas:** {ubicacion_seleccionada['lat']:.4f}, {ubicacion_seleccionada['lon']:.4f}")
+            st.write(f"**Dirección aproximada:** {ubicacion_seleccionada['display_name']}")
+            
+            # Botón para confirmar la selección
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                if st.button(f"✅ Confirmar {tipo_seleccionando.title()}", key=f"confirmar_{tipo_seleccionando}_mapa"):
+                    if tipo_seleccionando == "origen":
+                        st.session_state['direccion_origen_seleccionada'] = ubicacion_seleccionada
+                    else:
+                        st.session_state['direccion_destino_seleccionada'] = ubicacion_seleccionada
+                    
+                    st.session_state['ubicacion_temporal'] = None
+                    st.success(f"✅ {tipo_seleccionando.title()} confirmado!")
+                    st.rerun()
+            
+            with col2:
+                st.write("👆 Confirma la selección o haz clic en otro punto del mapa")
+
+
+# Fragmento: cambiar de conductor solo vuelve a ejecutar el mapa, no toda la página
+@st.fragment
+def fragmento_mapa_rutas(rutas_df, coordenadas_dict, nombre_a_id):
+    """Muestra el selector de conductor y el mapa de sus rutas."""
+    # Selector de conductor
+    conductor_seleccionado = st.selectbox(
+        "Seleccionar conductor para ver sus rutas:",
+        ["Todos"] + list(nombre_a_id)
+    )
+    
+    # Filtrar rutas según el conductor seleccionado
+    if conductor_seleccionado != "Todos":
+        conductor_id = nombre_a_id[conductor_seleccionado]
+        rutas_mapa = rutas_de_conductor(rutas_df, conductor_id)
+    else:
+        rutas_mapa = rutas_df
+
+    # Mostrar el mapa (HTML cacheado mientras no cambien las rutas)
+    components.html(construir_mapa_rutas_html(rutas_mapa, coordenadas_dict), width=700, height=500)
+
+
 if pagina == "Conductores":
     st.title("👨‍💼 Gestión de Conductores")
     
@@ -693,10 +1459,10 @@ if pagina == "Conductores":
                         if duplicados:
                             st.error(f"❌ IDs duplicados encontrados: {duplicados}")
                         else:
-                            st.session_state['conductores_df'] = pd.concat([
+                            st.session_state['conductores_df'] = tipar_conductores(pd.concat([
                                 st.session_state['conductores_df'],
                                 conductores_nuevos
-                            ], ignore_index=True)
+                            ], ignore_index=True))
                             st.session_state['conductores_cargados'] = True
                             st.success("✅ Conductores agregados exitosamente!")
                             st.rerun()
@@ -719,29 +1485,27 @@ if pagina == "Conductores":
         
         # Estadísticas rápidas
         col1, col2, col3, col4 = st.columns(4)
+        conteo_estados = conductores_df['estado'].value_counts()
         with col1:
             st.metric("Total Conductores", len(conductores_df))
         with col2:
-            activos = len(conductores_df[conductores_df['estado'] == 'Activo'])
-            st.metric("Activos", activos)
+            st.metric("Activos", int(conteo_estados['Activo']))
         with col3:
-            en_ruta = len(conductores_df[conductores_df['estado'] == 'En ruta'])
-            st.metric("En Ruta", en_ruta)
+            st.metric("En Ruta", int(conteo_estados['En ruta']))
         with col4:
-            descanso = len(conductores_df[conductores_df['estado'] == 'Descanso'])
-            st.metric("En Descanso", descanso)
+            st.metric("En Descanso", int(conteo_estados['Descanso']))
         
         # Filtros
         col1, col2 = st.columns(2)
         with col1:
-            filtro_estado = st.selectbox("Filtrar por estado:", ["Todos"] + list(conductores_df['estado'].unique()))
+            filtro_estado = st.selectbox("Filtrar por estado:", ["Todos"] + list(indices_por_estado(conductores_df)))
         with col2:
             filtro_nombre = st.text_input("🔍 Buscar por nombre:", placeholder="Ingresa nombre del conductor")
         
         # Aplicar filtros
-        conductores_filtrados = conductores_df.copy()
+        conductores_filtrados = conductores_df
         if filtro_estado != "Todos":
-            conductores_filtrados = conductores_filtrados[conductores_filtrados['estado'] == filtro_estado]
+            conductores_filtrados = conductores_df.iloc[indices_por_estado(conductores_df)[filtro_estado]]
         if filtro_nombre:
             conductores_filtrados = conductores_filtrados[
                 conductores_filtrados['nombre'].str.contains(filtro_nombre, case=False, na=False)
@@ -756,7 +1520,7 @@ if pagina == "Conductores":
         with col1:
             if st.button("🗑️ Limpiar Todos los Conductores"):
                 if st.button("⚠️ Confirmar Eliminación", type="secondary"):
-                    st.session_state['conductores_df'] = pd.DataFrame(columns=['id', 'nombre', 'licencia', 'telefono', 'vehiculo', 'estado'])
+                    st.session_state['conductores_df'] = tipar_conductores(pd.DataFrame(columns=['id', 'nombre', 'licencia', 'telefono', 'vehiculo', 'estado']))
                     st.session_state['conductores_cargados'] = False
                     st.warning("🗑️ Todos los conductores han sido eliminados")
                     st.rerun()
@@ -787,7 +1551,7 @@ if pagina == "Conductores":
                     with col2:
                         telefono = st.text_input("Teléfono")
                         vehiculo = st.text_input("Vehículo asignado")
-                        estado = st.selectbox("Estado", ["Activo", "En ruta", "Descanso", "Mantenimiento"])
+                        estado = st.selectbox("Estado", ESTADOS_CONDUCTOR)
                     
                     col1, col2 = st.columns(2)
                     with col1:
@@ -808,10 +1572,7 @@ if pagina == "Conductores":
                                 'vehiculo': vehiculo,
                                 'estado': estado
                             }
-                            st.session_state['conductores_df'] = pd.concat([
-                                st.session_state['conductores_df'],
-                                pd.DataFrame([nuevo_conductor])
-                            ], ignore_index=True)
+                            agregar_fila('conductores', nuevo_conductor)
                             st.session_state['mostrar_form_manual'] = False
                             st.success(f"✅ Conductor {nombre} agregado exitosamente!")
                             st.rerun()
@@ -832,61 +1593,44 @@ elif pagina == "Dashboard":
     # Métricas principales
     col1, col2, col3, col4 = st.columns(4)
     
+    metricas = metricas_dashboard(rutas_df, conductores_df)
+    
     with col1:
-        st.metric("Total Conductores", len(conductores_df))
+        st.metric("Total Conductores", metricas['total_conductores'])
     
     with col2:
-        rutas_activas = len(rutas_df[rutas_df['estado'] == 'En progreso'])
-        st.metric("Rutas Activas", rutas_activas)
+        st.metric("Rutas Activas", metricas['rutas_activas'])
     
     with col3:
-        distancia_total = rutas_df['distancia_km'].sum()
-        st.metric("Distancia Total (km)", f"{distancia_total:,}")
+        st.metric("Distancia Total (km)", f"{metricas['distancia_total']:,}")
     
     with col4:
-        carga_total = rutas_df['carga_kg'].sum()
-        st.metric("Carga Total (kg)", f"{carga_total:,}")
+        st.metric("Carga Total (kg)", f"{metricas['carga_total']:,}")
     
     # Gráficos de resumen
     col1, col2 = st.columns(2)
     
     with col1:
         # Estado de conductores
-        estado_conductores = conductores_df['estado'].value_counts()
-        fig_conductores = px.pie(
-            values=estado_conductores.values,
-            names=estado_conductores.index,
-            title="Estado de Conductores"
-        )
-        st.plotly_chart(fig_conductores, use_container_width=True)
+        fig_conductores = figura_pastel(*metricas['estado_conductores'], "Estado de Conductores")
+        st.plotly_chart(_cargar_json(fig_conductores), use_container_width=True, config=CONFIG_GRAFICO_ESTATICO)
     
     with col2:
         # Estado de rutas
-        estado_rutas = rutas_df['estado'].value_counts()
-        fig_rutas = px.pie(
-            values=estado_rutas.values,
-            names=estado_rutas.index,
-            title="Estado de Rutas"
-        )
-        st.plotly_chart(fig_rutas, use_container_width=True)
+        fig_rutas = figura_pastel(*metricas['estado_rutas'], "Estado de Rutas")
+        st.plotly_chart(_cargar_json(fig_rutas), use_container_width=True, config=CONFIG_GRAFICO_ESTATICO)
     
     # Rutas por conductor
-    rutas_por_conductor = rutas_df.groupby('conductor_id').size().reset_index(name='num_rutas')
-    rutas_por_conductor = rutas_por_conductor.merge(
-        conductores_df[['id', 'nombre']], 
-        left_on='conductor_id', 
-        right_on='id'
-    )
-    
-    fig_bar = px.bar(
-        rutas_por_conductor,
-        x='nombre',
-        y='num_rutas',
-        title="Número de Rutas por Conductor",
-        labels={'num_rutas': 'Número de Rutas', 'nombre': 'Conductor'}
+    estadisticas = estadisticas_por_conductor(rutas_df, conductores_df)
+    
+    fig_bar = figura_barras(
+        tuple(estadisticas['nombre']),
+        tuple(estadisticas['num_rutas'].tolist()),
+        "Número de Rutas por Conductor",
+        'Conductor',
+        'Número de Rutas'
     )
-    fig_bar.update_xaxes(tickangle=45)
-    st.plotly_chart(fig_bar, use_container_width=True)
+    st.plotly_chart(_cargar_json(fig_bar), use_container_width=True, config=CONFIG_GRAFICO_ESTATICO)
 
 elif pagina == "Conductores":
     st.title("👨‍💼 Gestión de Conductores")
@@ -894,12 +1638,12 @@ elif pagina == "Conductores":
     # Filtros
     col1, col2 = st.columns(2)
     with col1:
-        filtro_estado = st.selectbox("Filtrar por estado:", ["Todos"] + list(conductores_df['estado'].unique()))
+        filtro_estado = st.selectbox("Filtrar por estado:", ["Todos"] + list(indices_por_estado(conductores_df)))
     
     # Aplicar filtros
-    conductores_filtrados = conductores_df.copy()
+    conductores_filtrados = conductores_df
     if filtro_estado != "Todos":
-        conductores_filtrados = conductores_filtrados[conductores_filtrados['estado'] == filtro_estado]
+        conductores_filtrados = conductores_df.iloc[indices_por_estado(conductores_df)[filtro_estado]]
     
     # Mostrar tabla de conductores
     st.subheader("Lista de Conductores")
@@ -915,7 +1659,7 @@ elif pagina == "Conductores":
                 telefono = st.text_input("Teléfono")
             with col2:
                 vehiculo = st.text_input("Vehículo asignado")
-                estado = st.selectbox("Estado", ["Activo", "En ruta", "Descanso", "Mantenimiento"])
+                estado = st.selectbox("Estado", ESTADOS_CONDUCTOR)
             
             submitted = st.form_submit_button("Agregar Conductor")
             if submitted and nombre and licencia:
@@ -928,10 +1672,7 @@ elif pagina == "Conductores":
                     'vehiculo': vehiculo,
                     'estado': estado
                 }
-                st.session_state['conductores_df'] = pd.concat([
-                    st.session_state['conductores_df'],
-                    pd.DataFrame([nuevo_conductor])
-                ], ignore_index=True)
+                agregar_fila('conductores', nuevo_conductor)
                 st.success(f"Conductor {nombre} agregado exitosamente!")
 
 elif pagina == "Rutas":
@@ -946,43 +1687,44 @@ elif pagina == "Rutas":
     with col1:
         filtro_conductor = st.selectbox(
             "Filtrar por conductor:", 
-            ["Todos"] + list(conductores_df['nombre'].values)
+            ["Todos"] + nombres_conductores
         )
     with col2:
         filtro_estado_ruta = st.selectbox(
             "Filtrar por estado:", 
-            ["Todos"] + list(rutas_df['estado'].unique())
+            ["Todos"] + list(indices_por_estado(rutas_df))
         )
     with col3:
         filtro_fecha = st.date_input("Filtrar desde fecha:")
 
     # Aplicar filtros
-    rutas_filtradas = rutas_df.copy()
-    
-    if filtro_conductor != "Todos":
-        conductor_id = conductores_df[conductores_df['nombre'] == filtro_conductor]['id'].iloc[0]
-        rutas_filtradas = rutas_filtradas[rutas_filtradas['conductor_id'] == conductor_id]
+    rutas_filtradas = rutas_df
     
     if filtro_estado_ruta != "Todos":
-        rutas_filtradas = rutas_filtradas[rutas_filtradas['estado'] == filtro_estado_ruta]
+        rutas_filtradas = rutas_df.iloc[indices_por_estado(rutas_df)[filtro_estado_ruta]]
+    
+    if filtro_conductor != "Todos":
+        conductor_id = nombre_a_id[filtro_conductor]
+        rutas_filtradas = rutas_filtradas[rutas_filtradas['conductor_id'].values == conductor_id]
 
-    # Filtrar por fecha de inicio si se ha seleccionado una
+    # Filtrar por fecha de inicio si se ha seleccionado una (comparación directa en NumPy)
     if filtro_fecha:
-        rutas_filtradas = rutas_filtradas[rutas_filtradas['fecha_inicio'] >= pd.to_datetime(filtro_fecha)]
-    
-    # Agregar nombre del conductor a las rutas
-    rutas_con_conductor = rutas_filtradas.merge(
-        conductores_df[['id', 'nombre']], 
-        left_on='conductor_id', 
-        right_on='id',
-        suffixes=('', '_conductor')
-    )
+        mascara_fecha = rutas_filtradas['fecha_inicio'].values >= np.datetime64(filtro_fecha)
+        rutas_filtradas = rutas_filtradas[mascara_fecha]
     
     # Mostrar tabla de rutas
     st.subheader("Lista de Rutas")
-    columnas_mostrar = ['id', 'nombre', 'origen', 'destino', 'distancia_km', 
-                       'fecha_inicio', 'fecha_fin', 'estado', 'carga_kg']
-    st.dataframe(rutas_con_conductor[columnas_mostrar], use_container_width=True)
+    # Sin resultados no hace falta asignar nombres; el formulario de abajo se sigue mostrando
+    if rutas_filtradas.empty:
+        st.info("Sin resultados para los filtros seleccionados")
+    else:
+        # Agregar nombre del conductor a las rutas
+        nombres = rutas_filtradas['conductor_id'].map(nombres_por_id(conductores_df))
+        rutas_con_conductor = rutas_filtradas.assign(nombre=nombres)[nombres.notna()]
+        
+        columnas_mostrar = ['id', 'nombre', 'origen', 'destino', 'distancia_km', 
+                           'fecha_inicio', 'fecha_fin', 'estado', 'carga_kg']
+        st.dataframe(rutas_con_conductor[columnas_mostrar], use_container_width=True)
     
     # Formulario para agregar ruta con tabs
     with st.expander("➕ Planificar Nueva Ruta"):
@@ -1003,14 +1745,17 @@ elif pagina == "Rutas":
                     with st.spinner("Buscando origen..."):
                         st.session_state['resultados_origen'] = geocodificar_direccion(direccion_origen)
                 
-                for i, res in enumerate(st.session_state.get('resultados_origen', [])):
-                    st.write(f"📍 {res.get('display_name')}")
-                    if st.button("Seleccionar", key=f"sel_origen_texto_{i}"):
-                        res['metodo_seleccion'] = 'busqueda'
-                        st.session_state['direccion_origen_seleccionada'] = res
-                        st.session_state['resultados_origen'] = []
-                        st.success("✅ Origen seleccionado!")
-                        st.rerun()
+                resultados_origen = st.session_state.get('resultados_origen', [])
+                if resultados_origen:
+                    st.radio(
+                        "Selecciona el origen:",
+                        range(len(resultados_origen)),
+                        format_func=lambda i: f"📍 {resultados_origen[i].get('display_name')}",
+                        index=None,
+                        key="radio_origen_texto",
+                        on_change=seleccionar_resultado_busqueda,
+                        args=('origen',)
+                    )
 
             with col_busqueda2:
                 st.subheader("🎯 Destino")
@@ -1019,14 +1764,17 @@ elif pagina == "Rutas":
                     with st.spinner("Buscando destino..."):
                         st.session_state['resultados_destino'] = geocodificar_direccion(direccion_destino)
                 
-                for i, res in enumerate(st.session_state.get('resultados_destino', [])):
-                    st.write(f"🎯 {res.get('display_name')}")
-                    if st.button("Seleccionar", key=f"sel_destino_texto_{i}"):
-                        res['metodo_seleccion'] = 'busqueda'
-                        st.session_state['direccion_destino_seleccionada'] = res
-                        st.session_state['resultados_destino'] = []
-                        st.success("✅ Destino seleccionado!")
-                        st.rerun()
+                resultados_destino = st.session_state.get('resultados_destino', [])
+                if resultados_destino:
+                    st.radio(
+                        "Selecciona el destino:",
+                        range(len(resultados_destino)),
+                        format_func=lambda i: f"🎯 {resultados_destino[i].get('display_name')}",
+                        index=None,
+                        key="radio_destino_texto",
+                        on_change=seleccionar_resultado_busqueda,
+                        args=('destino',)
+                    )
         
         # TAB 2: Selección en mapa (nueva funcionalidad)
         with tab2:
@@ -1045,79 +1793,7 @@ elif pagina == "Rutas":
             </div>
             """, unsafe_allow_html=True)
             
-            # Selector de qué ubicación se está marcando
-            col1, col2 = st.columns(2)
-            with col1:
-                seleccionando = st.radio(
-                    "¿Qué ubicación estás seleccionando?",
-                    ["📍 Origen", "🎯 Destino"],
-                    key="radio_seleccion_mapa"
-                )
-            
-            with col2:
-                if st.button("🔄 Limpiar Selecciones", key="limpiar_mapa"):
-                    st.session_state['direccion_origen_seleccionada'] = None
-                    st.session_state['direccion_destino_seleccionada'] = None
-                    st.session_state['ubicacion_temporal'] = None
-                    st.rerun()
-            
-            # Preparar ubicaciones existentes para mostrar en el mapa
-            ubicaciones_para_mapa = {}
-            if st.session_state['direccion_origen_seleccionada']:
-                origen = st.session_state['direccion_origen_seleccionada']
-                ubicaciones_para_mapa['Origen'] = {
-                    'lat': float(origen['lat']),
-                    'lon': float(origen['lon']),
-                    'tipo': 'origen'
-                }
-
-            if st.session_state['direccion_destino_seleccionada']:
-                destino = st.session_state['direccion_destino_seleccionada']
-                ubicaciones_para_mapa['Destino'] = {
-                    'lat': float(destino['lat']),
-                    'lon': float(destino['lon']),
-                    'tipo': 'destino'
-                }
-
-            # Crear y mostrar el mapa interactivo
-            mapa_seleccion = crear_mapa_seleccion(ubicaciones_para_mapa)
-
-            # Mostrar el mapa y capturar interacciones
-            map_data = st_folium(
-                mapa_seleccion, 
-                width=700, 
-                height=400,
-                key="mapa_seleccion_ubicaciones"
-            )
-
-            # Procesar clicks en el mapa
-            if map_data['last_clicked'] is not None:
-                tipo_seleccionando = "origen" if "Origen" in seleccionando else "destino"
-                
-                ubicacion_seleccionada = procesar_click_mapa(map_data, tipo_seleccionando)
-                
-                if ubicacion_seleccionada:
-                    st.session_state['ubicacion_temporal'] = ubicacion_seleccionada
-                    
-                    st.info(f"📍 **Ubicación seleccionada para {tipo_seleccionando}:**")
-                    st.write(f"**Coordenadas:** {ubicacion_seleccionada['lat']:.4f}, {ubicacion_seleccionada['lon']:.4f}")
-                    st.write(f"**Dirección aproximada:** {ubicacion_seleccionada['display_name']}")
-                    
-                    # Botón para confirmar la selección
-                    col1, col2 = st.columns([1, 3])
-                    with col1:
-                        if st.button(f"✅ Confirmar {tipo_seleccionando.title()}", key=f"confirmar_{tipo_seleccionando}_mapa"):
-                            if tipo_seleccionando == "origen":
-                                st.session_state['direccion_origen_seleccionada'] = ubicacion_seleccionada
-                            else:
-                                st.session_state['direccion_destino_seleccionada'] = ubicacion_seleccionada
-                            
-                            st.session_state['ubicacion_temporal'] = None
-                            st.success(f"✅ {tipo_seleccionando.title()} confirmado!")
-                            st.rerun()
-                    
-                    with col2:
-                        st.write("👆 Confirma la selección o haz clic en otro punto del mapa")
+            fragmento_seleccion_mapa()
         
         # Mostrar resumen de ubicaciones seleccionadas (en ambos tabs)
         st.markdown("---")
@@ -1135,9 +1811,10 @@ elif pagina == "Rutas":
                 st.write(f"📍 {origen.get('display_name', 'N/A')}")
                 st.write(f"📐 Coords: {float(origen['lat']):.4f}, {float(origen['lon']):.4f}")
                 
-                if st.button("❌ Quitar Origen", key="quitar_origen"):
-                    st.session_state['direccion_origen_seleccionada'] = None
-                    st.rerun()
+                st.button(
+                    "❌ Quitar Origen", key="quitar_origen",
+                    on_click=quitar_seleccion, args=('origen',)
+                )
             else:
                 st.info("📍 **Origen no seleccionado**")
                 st.write("Usa la búsqueda por texto o selecciona en el mapa")
@@ -1152,9 +1829,10 @@ elif pagina == "Rutas":
                 st.write(f"🎯 {destino.get('display_name', 'N/A')}")
                 st.write(f"📐 Coords: {float(destino['lat']):.4f}, {float(destino['lon']):.4f}")
                 
-                if st.button("❌ Quitar Destino", key="quitar_destino"):
-                    st.session_state['direccion_destino_seleccionada'] = None
-                    st.rerun()
+                st.button(
+                    "❌ Quitar Destino", key="quitar_destino",
+                    on_click=quitar_seleccion, args=('destino',)
+                )
             else:
                 st.info("🎯 **Destino no seleccionado**")
                 st.write("Usa la búsqueda por texto o selecciona en el mapa")
@@ -1166,42 +1844,24 @@ elif pagina == "Rutas":
         if origen_sel and destino_sel:
             lat1, lon1 = float(origen_sel['lat']), float(origen_sel['lon'])
             lat2, lon2 = float(destino_sel['lat']), float(destino_sel['lon'])
-            distancia = calcular_distancia(lat1, lon1, lat2, lon2)
-            st.session_state['distancia_calculada'] = distancia
-            
             # Mostrar información de métodos de selección
             metodo_origen = "🗺️ Mapa" if origen_sel.get('metodo_seleccion') == 'mapa' else "🔍 Búsqueda"
             metodo_destino = "🗺️ Mapa" if destino_sel.get('metodo_seleccion') == 'mapa' else "🔍 Búsqueda"
             
+            distancia, mapa_prev_html = vista_previa_ruta(
+                lat1, lon1, lat2, lon2,
+                f"<b>Origen</b><br>{origen_sel.get('display_name', 'N/A')}<br>Método: {metodo_origen}",
+                f"<b>Destino</b><br>{destino_sel.get('display_name', 'N/A')}<br>Método: {metodo_destino}"
+            )
+            st.session_state['distancia_calculada'] = distancia
+            
             st.success(f"📊 **Ruta calculada:** {distancia:.1f} km")
             st.write(f"**Origen seleccionado via:** {metodo_origen}")
             st.write(f"**Destino seleccionado via:** {metodo_destino}")
 
             # Vista previa del mapa mejorada
             st.markdown("### 🗺️ Vista Previa de la Ruta")
-            mapa_prev = folium.Map(location=[(lat1 + lat2) / 2, (lon1 + lon2) / 2], zoom_start=8)
-            
-            folium.Marker(
-                [lat1, lon1], 
-                popup=f"<b>Origen</b><br>{origen_sel.get('display_name', 'N/A')}<br>Método: {metodo_origen}",
-                icon=folium.Icon(color='green', icon='play')
-            ).add_to(mapa_prev)
-            
-            folium.Marker(
-                [lat2, lon2], 
-                popup=f"<b>Destino</b><br>{destino_sel.get('display_name', 'N/A')}<br>Método: {metodo_destino}",
-                icon=folium.Icon(color='red', icon='stop')
-            ).add_to(mapa_prev)
-            
-            folium.PolyLine(
-                [[lat1, lon1], [lat2, lon2]], 
-                color="blue", 
-                weight=4, 
-                opacity=0.8,
-                popup=f"Distancia: {distancia:.1f} km"
-            ).add_to(mapa_prev)
-            
-            st_folium(mapa_prev, width=700, height=300)
+            components.html(mapa_prev_html, width=700, height=300)
 
             # Formulario final para crear la ruta
             st.markdown("### 📋 Detalles de la Ruta")
@@ -1209,7 +1869,7 @@ elif pagina == "Rutas":
                 col1, col2 = st.columns(2)
                 
                 with col1:
-                    conductor_seleccionado = st.selectbox("👨‍💼 Conductor", conductores_df['nombre'].values)
+                    conductor_seleccionado = st.selectbox("👨‍💼 Conductor", nombres_conductores)
                     carga_ruta = st.number_input("📦 Carga (kg)", min_value=1, value=1000)
                     
                 with col2:
@@ -1224,9 +1884,7 @@ elif pagina == "Rutas":
                 submitted_ruta = st.form_submit_button("🚛 Crear Ruta", use_container_width=True)
                 
                 if submitted_ruta:
-                    conductor_id = st.session_state['conductores_df'][
-                        st.session_state['conductores_df']['nombre'] == conductor_seleccionado
-                    ]['id'].iloc[0]
+                    conductor_id = nombre_a_id[conductor_seleccionado]
                     
                     nuevo_id = int(st.session_state['rutas_df']['id'].max()) + 1 if not st.session_state['rutas_df'].empty else 1
                     
@@ -1238,22 +1896,21 @@ elif pagina == "Rutas":
                     coordenadas_dict[origen_nombre] = [lat1, lon1]
                     coordenadas_dict[destino_nombre] = [lat2, lon2]
                     
+                    # La fecha se convierte una sola vez al insertar; la tabla ya queda tipada
+                    fecha_inicio = pd.Timestamp(fecha_inicio_ruta)
                     nueva_ruta = {
                         'id': nuevo_id,
                         'conductor_id': conductor_id,
                         'origen': origen_nombre,
                         'destino': destino_nombre,
                         'distancia_km': distancia,
-                        'fecha_inicio': pd.to_datetime(fecha_inicio_ruta),
-                        'fecha_fin': pd.to_datetime(fecha_inicio_ruta) + timedelta(days=1),
+                        'fecha_inicio': fecha_inicio,
+                        'fecha_fin': fecha_inicio + timedelta(days=1),
                         'estado': 'Planificada',
                         'carga_kg': carga_ruta
                     }
                     
-                    st.session_state['rutas_df'] = pd.concat([
-                        st.session_state['rutas_df'],
-                        pd.DataFrame([nueva_ruta])
-                    ], ignore_index=True)
+                    agregar_fila('rutas', nueva_ruta)
                     
                     st.success(f"🎉 Ruta creada: {origen_nombre} → {destino_nombre}")
                     st.success(f"📊 Distancia: {distancia:.1f} km | Carga: {carga_ruta} kg | Conductor: {conductor_seleccionado}")
@@ -1281,12 +1938,12 @@ elif pagina == "Optimización de Rutas":
     # Selector de conductor
     conductor_seleccionado = st.selectbox(
         "👨‍💼 Seleccionar conductor para optimizar:",
-        conductores_df['nombre'].values,
+        nombres_conductores,
         key="conductor_optimizacion"
     )
     
     if conductor_seleccionado:
-        conductor_id = conductores_df[conductores_df['nombre'] == conductor_seleccionado]['id'].iloc[0]
+        conductor_id = nombre_a_id[conductor_seleccionado]
         
         # Generar plan de optimización
         with st.spinner("🔄 Analizando y optimizando rutas..."):
@@ -1296,15 +1953,10 @@ elif pagina == "Optimización de Rutas":
             st.info(f"📝 No hay rutas pendientes para optimizar para {conductor_seleccionado}")
             
             # Mostrar rutas existentes del conductor
-            rutas_conductor = rutas_df[rutas_df['conductor_id'] == conductor_id]
+            rutas_conductor = rutas_de_conductor(rutas_df, conductor_id)
             if not rutas_conductor.empty:
                 st.subheader("📋 Rutas Actuales del Conductor")
-                rutas_con_conductor = rutas_conductor.merge(
-                    conductores_df[['id', 'nombre']], 
-                    left_on='conductor_id', 
-                    right_on='id'
-                )
-                st.dataframe(rutas_con_conductor[['id', 'origen', 'destino', 'distancia_km', 'fecha_inicio', 'estado', 'carga_kg']])
+                st.dataframe(rutas_conductor[['id', 'origen', 'destino', 'distancia_km', 'fecha_inicio', 'estado', 'carga_kg']])
         else:
             # Mostrar resumen del conductor
             conductor_info = plan_optimizado['conductor']
@@ -1360,17 +2012,24 @@ elif pagina == "Optimización de Rutas":
                 with st.expander(f"📅 {fecha} - {detalles['numero_destinos']} destinos"):
                     col1, col2 = st.columns(2)
                     
+                    # Cada bloque es un único elemento markdown en lugar de un widget por valor
                     with col1:
-                        st.markdown("**📊 Métricas:**")
-                        st.metric("📍 Origen", detalles['origen'])
-                        st.metric("🎯 Destinos", detalles['numero_destinos'])
-                        st.metric("📦 Carga Total", f"{detalles['carga_total']} kg")
-                        st.metric("🔧 Algoritmo", detalles['algoritmo'])
+                        st.markdown(
+                            "**📊 Métricas:**\n\n"
+                            "| | |\n|---|---|\n"
+                            f"| 📍 Origen | {detalles['origen']} |\n"
+                            f"| 🎯 Destinos | {detalles['numero_destinos']} |\n"
+                            f"| 📦 Carga Total | {detalles['carga_total']} kg |\n"
+                            f"| 🔧 Algoritmo | {NOMBRES_ALGORITMOS[detalles['algoritmo']]} |"
+                        )
                     
                     with col2:
-                        st.markdown("**🛣️ Distancias:**")
-                        st.metric("Actual", f"{detalles['distancia_actual']:.1f} km")
-                        st.metric("Optimizada", f"{detalles['distancia_optimizada']:.1f} km")
+                        st.markdown(
+                            "**🛣️ Distancias:**\n\n"
+                            "| | |\n|---|---|\n"
+                            f"| Actual | {detalles['distancia_actual']:.1f} km |\n"
+                            f"| Optimizada | {detalles['distancia_optimizada']:.1f} km |"
+                        )
                         st.metric(
                             "Ahorro", 
                             f"{detalles['ahorro_km']:.1f} km",
@@ -1378,60 +2037,39 @@ elif pagina == "Optimización de Rutas":
                         )
                     
                     # Orden recomendado
-                    st.markdown("**🗺️ Orden Recomendado de Visita:**")
-                    for i, destino in enumerate(detalles['orden_recomendado']):
-                        st.write(f"**{i+1}.** {destino}")
+                    st.markdown(
+                        "**🗺️ Orden Recomendado de Visita:**\n\n"
+                        + "\n".join(f"{i+1}. {destino}" for i, destino in enumerate(detalles['orden_recomendado']))
+                    )
                     
                     # Botón para ver mapa
                     if st.button(f"🗺️ Ver Mapa Optimizado", key=f"mapa_{fecha}"):
-                        st.session_state[f'mostrar_mapa_{fecha}'] = True
+                        st.session_state['mapas_visibles'].add(fecha)
                     
                     # Mostrar mapa si se solicitó
-                    if st.session_state.get(f'mostrar_mapa_{fecha}', False):
+                    if fecha in st.session_state['mapas_visibles']:
                         optimizaciones = analizar_rutas_conductor(conductor_id, rutas_df, coordenadas_dict)
                         if fecha in optimizaciones:
-                            mapa_opt = crear_mapa_ruta_optimizada(optimizaciones[fecha])
-                            if mapa_opt:
-                                st_folium(mapa_opt, width=700, height=400)
+                            mapa_opt_html = construir_mapa_optimizado_html(optimizaciones[fecha])
+                            if mapa_opt_html:
+                                components.html(mapa_opt_html, width=700, height=400)
                         
                         if st.button(f"❌ Ocultar Mapa", key=f"ocultar_mapa_{fecha}"):
-                            st.session_state[f'mostrar_mapa_{fecha}'] = False
+                            st.session_state['mapas_visibles'].discard(fecha)
                             st.rerun()
             
             # Comparación visual de eficiencia
             st.markdown("---")
             st.subheader("📊 Comparación Visual de Eficiencia")
             
-            fechas = list(plan_optimizado['fechas_optimizadas'].keys())
-            distancias_actual = [plan_optimizado['fechas_optimizadas'][f]['distancia_actual'] for f in fechas]
-            distancias_optimizada = [plan_optimizado['fechas_optimizadas'][f]['distancia_optimizada'] for f in fechas]
-            
-            fig_comparacion = go.Figure()
-            
-            fig_comparacion.add_trace(go.Bar(
-                name='Ruta Actual',
-                x=[str(f) for f in fechas],
-                y=distancias_actual,
-                marker_color='red',
-                opacity=0.7
-            ))
-            
-            fig_comparacion.add_trace(go.Bar(
-                name='Ruta Optimizada',
-                x=[str(f) for f in fechas],
-                y=distancias_optimizada,
-                marker_color='green',
-                opacity=0.7
-            ))
-            
-            fig_comparacion.update_layout(
-                title='Comparación de Distancias: Actual vs Optimizada',
-                xaxis_title='Fecha',
-                yaxis_title='Distancia (km)',
-                barmode='group'
+            fechas_optimizadas = plan_optimizado['fechas_optimizadas']
+            fig_comparacion = figura_comparacion(
+                tuple(str(f) for f in fechas_optimizadas),
+                tuple(detalle['distancia_actual'] for detalle in fechas_optimizadas.values()),
+                tuple(detalle['distancia_optimizada'] for detalle in fechas_optimizadas.values())
             )
             
-            st.plotly_chart(fig_comparacion, use_container_width=True)
+            st.plotly_chart(_cargar_json(fig_comparacion), use_container_width=True)
             
             # Acciones de optimización
             st.markdown("---")
@@ -1459,8 +2097,9 @@ elif pagina == "Optimización de Rutas":
                 with col1:
                     algoritmo_manual = st.selectbox(
                         "Algoritmo de optimización:",
-                        ["nearest_neighbor", "brute_force", "2opt"],
-                        help="• Nearest Neighbor: Rápido para muchos destinos\n• Brute Force: Óptimo para pocos destinos (≤8)\n• 2-Opt: Balance entre velocidad y calidad"
+                        list(NOMBRES_ALGORITMOS),
+                        format_func=NOMBRES_ALGORITMOS.get,
+                        help=f"• Nearest Neighbor: Rápido para muchos destinos\n• Exacto (Held-Karp): Óptimo hasta {MAX_DESTINOS_EXACTO} destinos\n• 2-Opt: Balance entre velocidad y calidad"
                     )
                 
                 with col2:
@@ -1475,20 +2114,28 @@ elif pagina == "Optimización de Rutas":
                         optimizaciones = analizar_rutas_conductor(conductor_id, rutas_df, coordenadas_dict)
                         if fecha_simular in optimizaciones:
                             opt_data = optimizaciones[fecha_simular]
-                            nuevo_orden, nueva_distancia = optimizar_ruta_multiple(
-                                opt_data['origen'], 
-                                opt_data['destinos_original'], 
-                                algoritmo_manual
+                            nuevo_orden, nueva_distancia = _optimizar_con_matriz(
+                                opt_data['matriz_distancia'], algoritmo_manual
                             )
                             
-                            st.success(f"✅ Simulación completada con {algoritmo_manual}")
+                            # Se informa el algoritmo que corrió, no solo el elegido
+                            algoritmo_ejecutado = algoritmo_aplicado(algoritmo_manual, opt_data['matriz_distancia'])
+                            if algoritmo_ejecutado != algoritmo_manual:
+                                st.info(
+                                    f"ℹ️ {NOMBRES_ALGORITMOS[algoritmo_manual]} admite hasta {MAX_DESTINOS_EXACTO} destinos; "
+                                    f"se usó {NOMBRES_ALGORITMOS[algoritmo_ejecutado]}"
+                                )
+                            st.success(f"✅ Simulación completada con {NOMBRES_ALGORITMOS[algoritmo_ejecutado]}")
                             st.metric("Nueva distancia", f"{nueva_distancia:.1f} km")
                             
                             # Mostrar nuevo orden
                             st.write("**Nuevo orden sugerido:**")
-                            for i, idx in enumerate(nuevo_orden):
-                                destino = opt_data['destinos_original'][idx]
-                                st.write(f"{i+1}. {destino['nombre']}")
+                            # Una sola lista numerada en lugar de un elemento por destino
+                            destinos_original = opt_data['destinos_original']
+                            st.markdown("\n".join(
+                                f"{i+1}. {destinos_original[idx]['nombre']}"
+                                for i, idx in enumerate(nuevo_orden)
+                            ))
 
 elif pagina == "Mapa de Rutas":
     if conductores_df.empty:
@@ -1496,79 +2143,7 @@ elif pagina == "Mapa de Rutas":
         st.warning("⚠️ No hay conductores cargados. Ve a la página 'Conductores' para cargar tu archivo.")
         st.stop()
     st.title("🗺️ Visualización de Rutas")
-    
-    # Selector de conductor
-    conductor_seleccionado = st.selectbox(
-        "Seleccionar conductor para ver sus rutas:",
-        ["Todos"] + list(conductores_df['nombre'].values)
-    )
-    
-    # Crear mapa centrado en Perú
-    mapa = folium.Map(location=[-9.19, -75.0152], zoom_start=6)
-    
-    # Filtrar rutas según el conductor seleccionado
-    if conductor_seleccionado != "Todos":
-        conductor_id = conductores_df[conductores_df['nombre'] == conductor_seleccionado]['id'].iloc[0]
-        rutas_mapa = rutas_df[rutas_df['conductor_id'] == conductor_id]
-    else:
-        rutas_mapa = rutas_df
-    
-    # Colores para diferentes estados
-    colores_estado = {
-        'Completada': 'green',
-        'En progreso': 'red',
-        'Planificada': 'blue'
-    }
-    
-    # Agregar marcadores y líneas para cada ruta
-    for _, ruta in rutas_mapa.iterrows():
-        if ruta['origen'] in coordenadas_dict and ruta['destino'] in coordenadas_dict:
-            # Coordenadas de origen y destino
-            coord_origen = coordenadas_dict[ruta['origen']]
-            coord_destino = coordenadas_dict[ruta['destino']]
-            
-            # Color según el estado
-            color = colores_estado.get(ruta['estado'], 'gray')
-            
-            # Marcador de origen
-            folium.Marker(
-                coord_origen,
-                popup=f"Origen: {ruta['origen']}<br>Ruta ID: {ruta['id']}",
-                icon=folium.Icon(color=color, icon='play')
-            ).add_to(mapa)
-            
-            # Marcador de destino
-            folium.Marker(
-                coord_destino,
-                popup=f"Destino: {ruta['destino']}<br>Ruta ID: {ruta['id']}",
-                icon=folium.Icon(color=color, icon='stop')
-            ).add_to(mapa)
-            
-            # Línea de la ruta
-            folium.PolyLine(
-                [coord_origen, coord_destino],
-                color=color,
-                weight=3,
-                opacity=0.7,
-                popup=f"Ruta {ruta['id']}: {ruta['origen']} → {ruta['destino']}<br>Estado: {ruta['estado']}<br>Distancia: {ruta['distancia_km']} km"
-            ).add_to(mapa)
-    
-    # Agregar leyenda
-    leyenda_html = '''
-    <div style="position: fixed; 
-                top: 10px; right: 10px; width: 150px; height: 90px; 
-                background-color: white; border:2px solid grey; z-index:9999; 
-                font-size:14px; padding: 10px">
-    <b>Estado de Rutas</b><br>
-    <i class="fa fa-circle" style="color:green"></i> Completada<br>
-    <i class="fa fa-circle" style="color:red"></i> En progreso<br>
-    <i class="fa fa-circle" style="color:blue"></i> Planificada<br>
-    </div>
-    '''
-    mapa.get_root().html.add_child(folium.Element(leyenda_html))
-    
-    # Mostrar el mapa
-    st_folium(mapa, width=700, height=500)
+    fragmento_mapa_rutas(rutas_df, coordenadas_dict, nombre_a_id)
 
 elif pagina == "Análisis":
     if conductores_df.empty:
@@ -1577,76 +2152,44 @@ elif pagina == "Análisis":
         st.stop()
     st.title("📈 Análisis de Rendimiento")
     
-    # Análisis de distancias
-    col1, col2 = st.columns(2)
+    # Agregados por conductor (un solo groupby para gráficos y resumen)
+    estadisticas = estadisticas_por_conductor(rutas_df, conductores_df)
     
-    with col1:
-        # Distancia por conductor
-        distancia_conductor = rutas_df.groupby('conductor_id')['distancia_km'].sum().reset_index()
-        distancia_conductor = distancia_conductor.merge(
-            conductores_df[['id', 'nombre']], 
-            left_on='conductor_id', 
-            right_on='id'
-        )
-        
-        fig_distancia = px.bar(
-            distancia_conductor,
-            x='nombre',
-            y='distancia_km',
-            title="Distancia Total por Conductor (km)",
-            labels={'distancia_km': 'Distancia (km)', 'nombre': 'Conductor'}
-        )
-        fig_distancia.update_xaxes(tickangle=45)
-        st.plotly_chart(fig_distancia, use_container_width=True)
-    
-    with col2:
-        # Carga por conductor
-        carga_conductor = rutas_df.groupby('conductor_id')['carga_kg'].sum().reset_index()
-        carga_conductor = carga_conductor.merge(
-            conductores_df[['id', 'nombre']], 
-            left_on='conductor_id', 
-            right_on='id'
-        )
-        
-        fig_carga = px.bar(
-            carga_conductor,
-            x='nombre',
-            y='carga_kg',
-            title="Carga Total por Conductor (kg)",
-            labels={'carga_kg': 'Carga (kg)', 'nombre': 'Conductor'}
-        )
-        fig_carga.update_xaxes(tickangle=45)
-        st.plotly_chart(fig_carga, use_container_width=True)
+    # Distancia y carga por conductor (una sola figura con dos paneles)
+    fig_totales = figura_totales_conductor(
+        tuple(estadisticas['nombre']),
+        tuple(estadisticas['distancia_total'].tolist()),
+        tuple(estadisticas['carga_total'].tolist())
+    )
+    st.plotly_chart(_cargar_json(fig_totales), use_container_width=True)
     
     # Análisis temporal
-    rutas_temp = rutas_df.copy()
-    rutas_temp['fecha_inicio'] = pd.to_datetime(rutas_temp['fecha_inicio'])
-    rutas_temporales = rutas_temp.groupby(rutas_temp['fecha_inicio'].dt.date).size().reset_index(name='num_rutas')
-    
-    fig_temporal = px.line(
-        rutas_temporales,
-        x='fecha_inicio',
-        y='num_rutas',
-        title="Rutas Programadas por Día",
-        labels={'num_rutas': 'Número de Rutas', 'fecha_inicio': 'Fecha'}
+    fig_temporal = figura_linea(
+        *rutas_por_dia(rutas_df),
+        "Rutas Programadas por Día",
+        'Fecha',
+        'Número de Rutas'
     )
-    st.plotly_chart(fig_temporal, use_container_width=True)
+    st.plotly_chart(_cargar_json(fig_temporal), use_container_width=True)
     
     # Tabla de resumen por conductor
     st.subheader("Resumen por Conductor")
-    resumen = rutas_df.groupby('conductor_id').agg({
-        'distancia_km': ['sum', 'mean', 'count'],
-        'carga_kg': ['sum', 'mean']
-    }).round(2)
-    
-    resumen.columns = ['Distancia Total', 'Distancia Promedio', 'Num. Rutas', 'Carga Total', 'Carga Promedio']
-    resumen = resumen.merge(
-        conductores_df[['id', 'nombre']], 
-        left_index=True, 
-        right_on='id'
-    ).set_index('nombre')
-    
-    st.dataframe(resumen, use_container_width=True)
+    resumen = estadisticas.set_index('nombre')[[
+        'distancia_total', 'distancia_promedio', 'num_rutas', 'carga_total', 'carga_promedio', 'id'
+    ]]
+    resumen.columns = ['Distancia Total', 'Distancia Promedio', 'Num. Rutas', 'Carga Total', 'Carga Promedio', 'id']
+    
+    # Los decimales se limitan solo al mostrar, sin crear una copia redondeada
+    formato_2_decimales = st.column_config.NumberColumn(format="%.2f")
+    st.dataframe(
+        resumen,
+        use_container_width=True,
+        column_config={
+            'Distancia Total': formato_2_decimales,
+            'Distancia Promedio': formato_2_decimales,
+            'Carga Promedio': formato_2_decimales
+        }
+    )
 
 # Footer
 st.sidebar.markdown("---")